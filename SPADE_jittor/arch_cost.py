@@ -0,0 +1,59 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+import jittor as jt
+from options.cost_options import CostOptions
+from models.pix2pix_model import Pix2PixModel
+from util.arch_cost import LayerCostRecorder, summarize, format_rows, write_csv
+from util.synthetic import synthetic_semantics, pg_level_epochs, input_size
+
+# Reports FLOPs, parameters and activation memory of every layer of G, D
+# and E for the given options, at every progressive growing level, e.g.
+#   python arch_cost.py --cost_batch 10 --use_seg_noise --num_D 4
+# Nothing is executed on the device: only the lazy graph is built.
+
+opt = CostOptions().parse()
+# the perceptual loss network is not part of the report
+opt.no_vgg_loss = True
+opt.diff_aug = ''
+if opt.USE_AMP:
+    jt.flags.auto_mixed_precision_level = 5
+
+model = Pix2PixModel(opt)
+param_counts = {'G': model.netG, 'D': model.netD, 'E': model.netE}
+param_counts = {k: sum(p.numel() for p in {id(p): p for p in net.parameters()}.values())
+                for k, net in param_counts.items() if net is not None}
+
+h, w = input_size(opt)
+print('Architecture cost at batch %d, input %dx%d, ngf %d, ndf %d, num_upsampling_layers %s, sr_scale %d, use_pos %s, use_seg_noise %s' %
+      (opt.cost_batch, h, w, opt.ngf, opt.ndf, opt.num_upsampling_layers, opt.sr_scale, opt.use_pos, opt.use_seg_noise))
+
+rows_by_level = []
+with jt.no_grad():
+    for level, epoch in pg_level_epochs(opt):
+        recorder = LayerCostRecorder()
+        recorder.attach(model.netG, 'G')
+        recorder.attach(model.netD, 'D')
+        if model.netE is not None:
+            recorder.attach(model.netE, 'E')
+        input_semantics = synthetic_semantics(opt, opt.cost_batch)
+        real_image = jt.zeros((opt.cost_batch, 3, h, w))
+        fake_image, _ = model.generate_fake(input_semantics, real_image, epoch)
+        model.discriminate(input_semantics, fake_image, real_image, epoch)
+        recorder.detach()
+        rows_by_level.append((level, recorder.rows))
+
+        outputs = fake_image if isinstance(fake_image, list) else [fake_image]
+        print('\n======== %s (epoch %d, G output %s) ========' %
+              (level, epoch, ', '.join('x'.join(str(d) for d in o.shape[-2:]) for o in outputs)))
+        if opt.cost_per_layer:
+            print(format_rows(recorder.rows))
+        for net, total in summarize(recorder.rows).items():
+            print('%s: %7.2f M params, %9.2f GFLOPs forward, %9.1f MB layer activations (%d layers)' %
+                  (net, param_counts.get(net, 0) / 1e6, total['flops'] / 1e9,
+                   total['act_bytes'] / 2**20, total['layers']))
+
+if len(opt.cost_csv) > 0:
+    write_csv(opt.cost_csv, rows_by_level)
+    print('per-layer costs written to %s' % opt.cost_csv)
@@ -0,0 +1,62 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+import copy
+import jittor as jt
+from options.bench_options import BenchOptions
+from models.pix2pix_model import Pix2PixModel
+from util.arch_cost import LayerCostRecorder, summarize
+from util.batch_probe import run_inference_steps, release_memory
+from util.synthetic import synthetic_batch, pg_level_epochs
+jt.flags.use_cuda = 1
+jt.flags.use_stat_allocator = 1
+
+# Compares the inference throughput of the generator with different
+# normalization layers at the same ngf and input size, e.g. SPADE against
+# the class-adaptive lookup tables of CLADE:
+#   python bench_norm.py --bench_norm_G=spectralspadesyncbatch3x3,spectralcladesyncbatch,spectralcladesyncbatch3x3 --bench_batch=1
+# Each configuration is built with random weights and timed on synthetic
+# label maps at full resolution (mask encoder included with --use_vae). The
+# forward GFLOPs are counted like arch_cost.py; the lookups of CLADE and
+# --index_spade are gathers and count as none.
+
+opt = BenchOptions().parse()
+opt.no_vgg_loss = True
+if opt.USE_AMP:
+    jt.flags.auto_mixed_precision_level = 5
+
+norms = [norm for norm in opt.bench_norm_G.split(',') if len(norm) > 0]
+if len(norms) == 0:
+    norms = [opt.norm_G, opt.norm_G.replace('spade', 'clade')]
+epoch = pg_level_epochs(opt)[-1][1]
+
+results = []
+for norm_G in norms:
+    print('benchmarking norm_G=%s' % norm_G)
+    norm_opt = copy.deepcopy(opt)
+    norm_opt.norm_G = norm_G
+    model = Pix2PixModel(norm_opt)
+    model.eval()
+    params = sum(p.numel() for p in {id(p): p for p in model.netG.parameters()}.values())
+
+    recorder = LayerCostRecorder()
+    recorder.attach(model.netG, 'G')
+    with jt.no_grad():
+        input_semantics, real_image = model.preprocess_input(synthetic_batch(norm_opt, opt.bench_batch))
+        model.generate_fake(input_semantics, real_image, epoch)
+    recorder.detach()
+    flops = summarize(recorder.rows)['G']['flops']
+
+    peak, step_time = run_inference_steps(model, norm_opt, epoch, opt.bench_batch, opt.bench_steps)
+    results.append((norm_G, params, flops, peak, step_time))
+    del model
+    release_memory()
+
+print('\nngf %d, batch %d, %d timed passes' % (opt.ngf, opt.bench_batch, opt.bench_steps - 1))
+print('{:<32} {:>10} {:>12} {:>10} {:>10} {:>10} {:>8}'.format(
+    'norm_G', 'G params(M)', 'G GFLOPs', 'mem(MB)', 's/batch', 'img/s', 'speed'))
+base_time = results[0][4]
+for norm_G, params, flops, peak, step_time in results:
+    print('{:<32} {:>10.2f} {:>12.2f} {:>10.0f} {:>10.4f} {:>10.1f} {:>7.2f}x'.format(
+        norm_G, params / 1e6, flops / 1e9, peak / 2**20, step_time, opt.bench_batch / step_time, base_time / step_time))
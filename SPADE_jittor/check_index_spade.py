@@ -0,0 +1,68 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+import argparse
+import numpy as np
+import jittor as jt
+from jittor import nn
+from models.networks.normalization import LabelPyramid, conv_label_map
+
+# Checks that the convolutions of --index_spade, gathered from the class
+# indices (see label_conv), match the dense convolutions of the one-hot label
+# map built like Pix2PixModel.preprocess_input, e.g.
+#   python check_index_spade.py --label_nc=29
+# Every case runs with and without the dontcare channel and the instance
+# edge channel, at the size of the label map and resized, on label maps
+# with indices out of range (255, -1) among the valid ones.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--label_nc', type=int, default=29)
+parser.add_argument('--batch_size', type=int, default=2)
+parser.add_argument('--height', type=int, default=32)
+parser.add_argument('--width', type=int, default=64)
+parser.add_argument('--atol', type=float, default=1e-4)
+parser.add_argument('--gpu', action='store_true')
+opt = parser.parse_args()
+jt.flags.use_cuda = 1 if opt.gpu else 0
+
+
+def random_label_map(nc):
+    label = np.random.randint(0, nc, (opt.batch_size, 1, opt.height, opt.width))
+    out_of_range = np.random.rand(*label.shape)
+    label[out_of_range < 0.05] = 255
+    label[out_of_range > 0.95] = -1
+    return jt.array(label.astype(np.float32))
+
+
+def instance_edges(B, H, W):
+    return jt.array((np.random.rand(B, 1, H, W) < 0.1).astype(np.float32))
+
+
+def check(nc, with_instance, size, ks):
+    label_map = random_label_map(nc)
+    B, _, H, W = label_map.shape
+    semantics = jt.zeros((B, nc, H, W)).scatter_(1, label_map, jt.array(1.0))
+    if with_instance:
+        semantics = jt.contrib.concat((semantics, instance_edges(B, H, W)), dim=1)
+    conv = nn.Conv2d(semantics.shape[1], 16, kernel_size=ks, padding=ks // 2)
+    labels = LabelPyramid(semantics, label_map.int32(), nc)
+    dense = conv_label_map(conv, labels, size, gather=False)
+    gathered = conv_label_map(conv, labels, size, gather=True)
+    error = float(jt.abs(dense - gathered).max())
+    ok = error <= opt.atol
+    print('%s nc=%d instance=%d size=%s ks=%d max error %.2e'
+          % ('ok  ' if ok else 'FAIL', nc, with_instance, size, ks, error))
+    return ok
+
+
+results = []
+for dontcare in (False, True):
+    nc = opt.label_nc + 1 if dontcare else opt.label_nc
+    for with_instance in (False, True):
+        for size in ((opt.height, opt.width), (opt.height // 2, opt.width // 2)):
+            for ks in (1, 3):
+                results.append(check(nc, with_instance, size, ks))
+if not all(results):
+    raise SystemExit('%d of %d cases differ' % (results.count(False), len(results)))
+print('all %d cases match' % len(results))
@@ -52,3 +52,44 @@ def create_dataloader(opt):
     drop_last=opt.isTrain)
     
     return dataloader
+
+
+# options the dataset reads when it is created or loads an item
+DATASET_OPTIONS = ('dataset_mode', 'dataroot', 'input_path', 'label_dir', 'image_dir',
+                   'instance_dir', 'phase', 'preprocess_mode', 'load_size', 'crop_size',
+                   'aspect_ratio', 'no_flip', 'label_nc', 'contain_dontcare_label',
+                   'no_instance', 'max_dataset_size', 'no_pairing_check',
+                   'remove_hard_imgs', 'remove_img_txt_path', 'isTrain')
+
+
+# Keeps the dataset of |dataloader| (file lists, caches) for a run with the
+# options |opt| when they only change how it is batched, e.g. the next
+# phase of train.py. Otherwise a new dataloader is created.
+def reuse_dataloader(dataloader, opt):
+    if any(getattr(dataloader.opt, k, None) != getattr(opt, k, None) for k in DATASET_OPTIONS):
+        return create_dataloader(opt)
+    dataloader.opt = opt
+    return dataloader.set_attrs(
+    batch_size=opt.batchSize,
+    shuffle= not opt.serial_batches,
+    num_workers=int(opt.nThreads),
+    drop_last=opt.isTrain)
+
+
+# Repeats the last item of a partial batch up to |batch_size| items. The last
+# batch of a test run then has the shape of the others and reuses their
+# compiled kernels. Returns the batch and the number of real items.
+def pad_batch(data, batch_size):
+    num_items = len(data['path'])
+    if num_items >= batch_size:
+        return data, num_items
+    num_pad = batch_size - num_items
+    padded = {}
+    for k, v in data.items():
+        if isinstance(v, jittor.Var):
+            padded[k] = jittor.contrib.concat([v] + [v[-1:]] * num_pad, dim=0)
+        elif isinstance(v, list):
+            padded[k] = v + [v[-1]] * num_pad
+        else:
+            padded[k] = v
+    return padded, num_items
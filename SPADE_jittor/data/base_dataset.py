@@ -12,6 +12,9 @@ import random
 class BaseDataset(Dataset):
     def __init__(self):
         super(BaseDataset, self).__init__()
+        # batches of the permutation left out of every pass, see
+        # util.train_state.set_start_batch
+        self.start_batch = 0
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -20,6 +23,17 @@ class BaseDataset(Dataset):
     def initialize(self, opt):
         pass
 
+    # the permutation of the pass without its first |start_batch| batches,
+    # which are then never loaded. The permutation is drawn whole, so the
+    # shuffling generator advances like in a full pass.
+    def _get_index_list(self):
+        index_list = super(BaseDataset, self)._get_index_list()
+        if self.start_batch > 0:
+            index_list = index_list[self.start_batch * self.real_batch_size:]
+            self.real_len = len(index_list)
+            self.batch_len = max(0, self.batch_len - self.start_batch)
+        return index_list
+
 
 def get_params(opt, size):
     w, h = size
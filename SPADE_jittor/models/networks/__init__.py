@@ -3,7 +3,7 @@ Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
 Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
 """
 
-from models.networks.base_network import BaseNetwork
+from models.networks.base_network import BaseNetwork, attach_forward_timer, detach_forward_timer
 from models.networks.loss import *
 from models.networks.discriminator import *
 from models.networks.generator import *
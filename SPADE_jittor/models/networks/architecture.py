@@ -6,7 +6,7 @@ import jittor
 import jittor as jt
 from jittor import nn
 import torchvision
-from models.networks.normalization import SPADE, spectral_norm
+from models.networks.normalization import SPADE, CLADE, spectral_norm, NoiseTape, noise_tape, label_pyramid, convert_fused_weights
 from jittor import models
 
 # ResNet block that uses SPADE.
@@ -37,33 +37,113 @@ class SPADEResnetBlock(nn.Module):
 
         # define normalization layers
         spade_config_str = opt.norm_G.replace('spectral', '')
-        self.norm_0 = SPADE(spade_config_str, fin, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt)
-        self.norm_1 = SPADE(spade_config_str, fmiddle, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt)
-        if self.learned_shortcut:
-            self.norm_s = SPADE(spade_config_str, fin, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt)
+        if spade_config_str.startswith('clade'):
+            # class-adaptive lookup tables instead of SPADE, see CLADE
+            self.shared_input = False
+            self.norm_0 = CLADE(spade_config_str, fin, opt.semantic_nc, add_noise=opt.add_noise, opt=opt)
+            self.norm_1 = CLADE(spade_config_str, fmiddle, opt.semantic_nc, add_noise=opt.add_noise, opt=opt)
+            if self.learned_shortcut:
+                self.norm_s = CLADE(spade_config_str, fin, opt.semantic_nc, add_noise=opt.add_noise, opt=opt)
+        else:
+            # with --fused_spade, norm_0 and norm_s see the same label map at the
+            # same resolution and run their first convolution as one
+            self.shared_input = opt.fused_spade and self.learned_shortcut
+            self.norm_0 = SPADE(spade_config_str, fin, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt, shared_input=self.shared_input)
+            self.norm_1 = SPADE(spade_config_str, fmiddle, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt)
+            if self.learned_shortcut:
+                self.norm_s = SPADE(spade_config_str, fin, opt.semantic_nc, use_pos=opt.use_pos, use_pos_proj=opt.use_pos_proj, add_noise = opt.add_noise, opt=opt, shared_input=self.shared_input)
+        if self.shared_input:
+            nhidden, ks = self.norm_0.nhidden, self.norm_0.ks
+            self.mlp_shared_0s = nn.Sequential(
+                nn.Conv2d(opt.semantic_nc, 2 * nhidden, kernel_size=ks, padding=ks // 2),
+                nn.ReLU()
+            )
+        # recompute the activations in backward instead of storing them,
+        # see SPADEGenerator.set_recompute
+        self.recompute = False
+
     # note the resnet block with SPADE also takes in |seg|,
     # the semantic segmentation map as input
     def execute(self, x, seg):
-        x_s = self.shortcut(x, seg)
+        if self.recompute and self.is_training() and not jt.flags.no_grad:
+            return RecomputeBlock(self)(x, seg, *self.trainable_parameters())
+        return self.forward_block(x, seg)
+
+    def trainable_parameters(self):
+        params = {id(p): p for p in self.parameters()}
+        return [p for p in params.values() if not p.is_stop_grad()]
 
-        dx = self.conv_0(self.actvn(self.norm_0(x, seg)))
+    def forward_block(self, x, seg):
+        actv_0, actv_s = self.shared_actv(x, seg)
+        x_s = self.shortcut(x, seg, actv_s)
+
+        dx = self.conv_0(self.actvn(self.norm_0(x, seg, actv_0)))
         dx = self.conv_1(self.actvn(self.norm_1(dx, seg)))
 
         out = x_s + dx
 
         return out
 
-    def shortcut(self, x, seg):
+    def shortcut(self, x, seg, actv=None):
         if self.learned_shortcut:
-            x_s = self.conv_s(self.norm_s(x, seg))
+            x_s = self.conv_s(self.norm_s(x, seg, actv))
         else:
             x_s = x
         return x_s
 
+    # see SPADE.prepare_pos_embed, |size| is the size of the input
+    def prepare_pos_embeds(self, size):
+        for norm in (self.norm_0, self.norm_1, getattr(self, 'norm_s', None)):
+            if isinstance(norm, SPADE):
+                norm.prepare_pos_embed(size)
+
+    # mlp_shared activations of norm_0 and norm_s, None without --fused_spade
+    def shared_actv(self, x, seg):
+        if not self.shared_input:
+            return None, None
+        actv = self.norm_0.shared_labels(self.mlp_shared_0s, label_pyramid(seg), x.size()[2:])
+        nhidden = actv.shape[1] // 2
+        return actv[:, :nhidden], actv[:, nhidden:]
+
+    # checkpoints saved with and without --fused_spade load into either
+    def convert_state_dict(self, weights, prefix):
+        if not self.learned_shortcut or isinstance(self.norm_0, CLADE):
+            return {}, []
+        return convert_fused_weights(weights, prefix + 'mlp_shared_0s.0.',
+                                     [prefix + 'norm_0.mlp_shared.0.', prefix + 'norm_s.mlp_shared.0.'], self.shared_input)
+
     def actvn(self, x):
         return nn.leaky_relu(x, 2e-1)
 
 
+# Runs a SPADEResnetBlock without keeping its intermediate activations
+# (the normalized maps, every SPADE's 128-channel mlp_shared output, ...).
+# Only the block input is kept; backward runs the block a second time and
+# differentiates that copy. The SPADE noise of the first pass is replayed so
+# that both passes compute the same function.
+class RecomputeBlock(jt.Function):
+    def __init__(self, block):
+        self.block = block
+
+    def execute(self, x, seg, *params):
+        self.x, self.seg = x, seg
+        self.tape = NoiseTape()
+        # the recomputation runs from backward, outside the precision scope
+        # of the forward pass (see util.amp.PrecisionPolicy)
+        self.amp_level = jt.flags.auto_mixed_precision_level
+        with jt.no_grad(), noise_tape(self.tape):
+            out = self.block.forward_block(x, seg)
+        return out
+
+    def grad(self, dout):
+        params = self.block.trainable_parameters()
+        with jt.enable_grad(), noise_tape(self.tape.replay()), \
+             jt.flag_scope(auto_mixed_precision_level=self.amp_level):
+            out = self.block.forward_block(self.x, self.seg)
+        grads = jt.grad((out * dout).sum(), [self.x] + params)
+        return (grads[0], None) + tuple(grads[1:])
+
+
 # ResNet block used in pix2pixHD
 # We keep the same architecture as pix2pixHD.
 class ResnetBlock(nn.Module):
@@ -6,6 +6,51 @@ Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses
 import jittor as jt
 from jittor import init
 from jittor import nn
+import re
+
+
+# Submodules whose forward calls are timed by enable_forward_timing():
+# every SPADE and SPADE/pix2pixHD resnet block, each discriminator scale,
+# and the numbered stages of the encoder and the VGG loss network.
+TIMED_MODULE_CLASSES = ('SPADE', 'CLADE', 'SPADEResnetBlock', 'ResnetBlock', 'NLayerDiscriminator')
+TIMED_MODULE_NAMES = re.compile(r'^(slice|layer)\d+$')
+
+
+def attach_forward_timer(net, timer, prefix):
+    for name, module in net.named_modules():
+        short_name = name.split('.')[-1]
+        if name == '' or type(module).__name__ in TIMED_MODULE_CLASSES or \
+           TIMED_MODULE_NAMES.match(short_name):
+            full_name = prefix if name == '' else prefix + '.' + name
+            # keep calling a pre-forward hook the layer already has before
+            # starting the clock
+            prev_pre_hook = getattr(module, '__fhook2__', None)
+            prev_hook = getattr(module, '__fhook__', None)
+
+            def pre_hook(m, *args, full_name=full_name, prev_pre_hook=prev_pre_hook):
+                if prev_pre_hook is not None:
+                    prev_pre_hook(m, *args)
+                timer.start(full_name)
+
+            def post_hook(m, *args, full_name=full_name, prev_hook=prev_hook):
+                timer.stop(full_name)
+                if prev_hook is not None:
+                    prev_hook(m, *args)
+
+            module.register_pre_forward_hook(pre_hook)
+            module.register_forward_hook(post_hook)
+            timer.attached.append((module, prev_pre_hook, prev_hook))
+
+
+def detach_forward_timer(timer):
+    for module, prev_pre_hook, prev_hook in timer.attached:
+        for attr, prev in (('__fhook2__', prev_pre_hook), ('__fhook__', prev_hook)):
+            if prev is None:
+                if hasattr(module, attr):
+                    delattr(module, attr)
+            else:
+                setattr(module, attr, prev)
+    timer.attached = []
 
 
 class BaseNetwork(nn.Module):
@@ -26,6 +71,35 @@ class BaseNetwork(nn.Module):
               'To see the architecture, do print(network).'
               % (type(self).__name__, num_params / 1000000))
 
+    # Returns the state dict |weights| (numpy or jittor values) in the layout
+    # of this network. Submodules with a convert_state_dict method convert
+    # the entries of checkpoints saved with other options, e.g. SPADE layers
+    # with and without --fused_spade. |weights| is returned as is when
+    # nothing changes, so lazily loaded tensor files stay lazy.
+    def upgrade_state_dict(self, weights):
+        new_entries, replaced = {}, []
+        for name, module in self.named_modules():
+            if module is not self and hasattr(module, 'convert_state_dict'):
+                entries, keys = module.convert_state_dict(weights, name + '.')
+                new_entries.update(entries)
+                replaced += keys
+        if len(replaced) == 0:
+            return weights
+        print('converted %d weights of %s to the current layout' % (len(replaced), type(self).__name__))
+        replaced = set(replaced)
+        upgraded = {k: weights[k] for k in weights.keys() if k not in replaced}
+        upgraded.update(new_entries)
+        return upgraded
+
+    # time the forward of every submodule listed in TIMED_MODULE_CLASSES /
+    # TIMED_MODULE_NAMES with |timer| (a util.profiler.ForwardTimer)
+    def enable_forward_timing(self, timer, prefix=None):
+        prefix = type(self).__name__ if prefix is None else prefix
+        attach_forward_timer(self, timer, prefix)
+
+    def disable_forward_timing(self, timer):
+        detach_forward_timer(timer)
+
     def init_weights(self, init_type='normal', gain=0.02):
         def init_func(m):
             classname = m.__class__.__name__
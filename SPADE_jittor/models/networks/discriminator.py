@@ -64,18 +64,32 @@ class MultiscaleDiscriminator(BaseNetwork):
             raise ValueError('unrecognized discriminator subarchitecture %s' % subarch)
         return netD
 
-    def downsample(self, input):
+    def pool(self, input):
         if self.opt.USE_AMP:
-            return jt.float16(nn.avg_pool2d(input, kernel_size=3,
+            # float16 or float32 following the precision policy of D
+            return jt.float_auto(nn.avg_pool2d(input, kernel_size=3,
                             stride=2, padding=1,
                             count_include_pad=False))
         return nn.avg_pool2d(input, kernel_size=3,
                             stride=2, padding=1,
                             count_include_pad=False)
 
+    # |input| is the label map concatenated with the fake and the real
+    # images along the batch. With the LabelPyramid of that label map only
+    # the image channels are pooled here; the label map is pooled once for
+    # both halves and kept in the pyramid.
+    def downsample(self, input, labels=None):
+        if labels is None:
+            return self.pool(input)
+        images = self.pool(input[:, labels.num_channels:])
+        label_map = labels.pooled(images.shape[2:], self.pool)
+        label_map = jt.contrib.concat([label_map] * (images.shape[0] // label_map.shape[0]), dim=0)
+        return jt.contrib.concat([label_map, images], dim=1)
+
     # Returns list of lists of discriminator outputs.
     # The final result is of size opt.num_D x opt.n_layers_D
-    def execute(self, input, epoch):
+    # |labels|: LabelPyramid of the label channels of |input|
+    def execute(self, input, epoch, labels=None):
         result = []
         get_intermediate_features = not self.opt.no_ganFeat_loss
 
@@ -106,7 +120,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                     result.append(out)
                     if self.opt.one_pg_D:
                         break
-                    input = self.downsample(input)
+                    input = self.downsample(input, labels)
             else:
                 current_level = epoch // (self.opt.pg_niter//(self.opt.num_D - 1))
                 alpha = (epoch % (self.opt.pg_niter//(self.opt.num_D - 1))) / (self.opt.pg_niter//(self.opt.num_D - 1)/2) - 1
@@ -128,7 +142,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                             result.append(out)
                             if self.opt.one_pg_D:
                                 break
-                            input = self.downsample(input)
+                            input = self.downsample(input, labels)
 
                     else:
                         input = input[0]
@@ -144,7 +158,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                         if not get_intermediate_features:
                             out = [out]
                         result.append(out)
-                        input = self.downsample(input)
+                        input = self.downsample(input, labels)
                         
                         if self.opt.reverse_map_D:
                             ordered_D = range( current_level+1)
@@ -159,7 +173,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                             if not get_intermediate_features:
                                 out = [out]
                             result.append(out)
-                            input = self.downsample(input)
+                            input = self.downsample(input, labels)
 
         elif self.opt.pg_strategy == 3:
             if type(input)==list:
@@ -181,7 +195,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                     result.append(out)
                     if self.opt.one_pg_D:
                         break
-                    input = self.downsample(input)
+                    input = self.downsample(input, labels)
             else:
                 current_level = epoch // (self.opt.pg_niter//(self.opt.num_D - 1))
                 alpha = (epoch % (self.opt.pg_niter//(self.opt.num_D - 1))) / (self.opt.pg_niter//(self.opt.num_D - 1)/2) - 1
@@ -199,7 +213,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                             result.append(out)
                             if self.opt.one_pg_D:
                                 break
-                            input = self.downsample(input)
+                            input = self.downsample(input, labels)
 
                     else:
                         input = input[0]
@@ -218,7 +232,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                             result.append(out)
                             if self.opt.one_pg_D:
                                 break
-                            input = self.downsample(input)
+                            input = self.downsample(input, labels)
         else:
             for i in range(self.opt.num_D):
                 D = eval(f'self.multiscale_discriminator_{i}')
@@ -226,7 +240,7 @@ class MultiscaleDiscriminator(BaseNetwork):
                 if not get_intermediate_features:
                     out = [out]
                 result.append(out)
-                input = self.downsample(input)
+                input = self.downsample(input, labels)
         return result
 
 
@@ -6,7 +6,7 @@ import jittor as jt
 from jittor import init
 from jittor import nn
 from models.networks.base_network import BaseNetwork
-from models.networks.normalization import get_nonspade_norm_layer
+from models.networks.normalization import get_nonspade_norm_layer, label_pyramid
 from models.networks.architecture import ResnetBlock as ResnetBlock
 from models.networks.architecture import SPADEResnetBlock as SPADEResnetBlock
 
@@ -17,6 +17,8 @@ class SPADEGenerator(BaseNetwork):
         parser.add_argument('--num_upsampling_layers',
                             choices=('normal', 'more', 'most'), default='normal',
                             help="If 'more', adds upsampling layer between the two middle resnet blocks. If 'most', also add one more upsampling + resnet layer at the end of the generator")
+        parser.add_argument('--recompute_up', type=str, default='',
+                            help='comma separated indices of the up_* SPADE resnet blocks (0: lowest resolution) whose activations are recomputed in backward instead of stored, e.g. 2,3 for the two highest resolutions of a 4 level generator')
 
         return parser
 
@@ -77,6 +79,38 @@ class SPADEGenerator(BaseNetwork):
         self.out_conv_img = nn.Conv2d(final_nc, 3, 3, padding=1)
 
         self.up = nn.Upsample(scale_factor=2)
+        self.set_recompute(opt.recompute_up)
+        if opt.use_pos:
+            self.prepare_pos_embeds()
+
+    # Computes the positional embeddings of the SPADE layers at the size
+    # of the activations of every block for the configured crop size, once
+    # per process (see normalization.pos_embed). Other sizes are computed at
+    # their first forward.
+    def prepare_pos_embeds(self):
+        blocks = [('head_0', 1), ('G_middle_0', 2), ('G_middle_1', 2)]
+        blocks += [('up_%d' % i, 2**(i + 2)) for i in range(self.layer_level)]
+        for name, scale in blocks:
+            block = getattr(self, name)
+            if isinstance(block, SPADEResnetBlock):
+                block.prepare_pos_embeds((self.sh * scale, self.sw * scale))
+
+    # Trade compute for memory: the selected up_* blocks keep only their input
+    # during the forward pass and run again in backward, see
+    # architecture.RecomputeBlock. |levels| is a list of indices or a comma
+    # separated string like --recompute_up.
+    def set_recompute(self, levels):
+        if isinstance(levels, str):
+            levels = [int(level) for level in levels.split(',') if level.strip() != '']
+        for level in levels:
+            if level < 0 or level >= self.layer_level:
+                raise ValueError('--recompute_up: there is no up_%d block' % level)
+        for i in range(self.layer_level):
+            up_conv = getattr(self, 'up_%d' % i)
+            if isinstance(up_conv, SPADEResnetBlock):
+                up_conv.recompute = i in levels
+            elif i in levels:
+                print('up_%d is not a SPADE resnet block, it is not recomputed' % i)
 
     def compute_latent_vector_size(self, opt):
         if opt.num_upsampling_layers == 'normal':
@@ -98,8 +132,14 @@ class SPADEGenerator(BaseNetwork):
         up_res =  nn.interpolate(low_res, high_res.shape[-2:])
         return high_res*alpha + up_res*(1-alpha)
 
-    def execute(self, input, epoch=0, z=None):
-        seg = input
+    # |input|: label map or LabelPyramid, the blocks share its resized maps.
+    # With |num_samples| K > 1 the generator runs K samples of every label
+    # map in one batch, stacked sample after sample (sample k of label map b
+    # at k * B + b), e.g. with K codes in |z| or K noise draws: the SPADE
+    # layers compute gamma and beta once per label map and broadcast them,
+    # see Pix2PixModel.generate_variants.
+    def execute(self, input, epoch=0, z=None, num_samples=1):
+        seg = label_pyramid(input)
         print_inf = False
         if self.cur_ep != epoch:
             print_inf = True
@@ -112,14 +152,17 @@ class SPADEGenerator(BaseNetwork):
             else:
                 # we sample z from unit normal and reshape the tensor
                 if z is None:
-                    z = jt.randn(input.size(0), self.opt.z_dim,
-                                    dtype=jt.float32, device=input.get_device())
+                    z = jt.randn(seg.labels.size(0) * num_samples, self.opt.z_dim,
+                                    dtype=jt.float32, device=seg.labels.get_device())
                 x = self.fc(z)
                 x = x.view(-1, 16 * self.opt.ngf, self.sh, self.sw)
         else:
             # we downsample segmap and run convolution
-            x = nn.interpolate(seg, size=(self.sh, self.sw))
+            x = seg.resize((self.sh, self.sw), mode='bilinear')
             x = self.fc(x)
+        # a head computed from the label map only is the same for all samples
+        if x.shape[0] != seg.labels.shape[0] * num_samples:
+            x = jt.contrib.concat([x] * num_samples, dim=0)
 
         x = self.head_0(x, seg)
         if self.opt.use_interFeature_pos: x = x + self.pos_emb_head
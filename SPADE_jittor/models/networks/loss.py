@@ -13,15 +13,17 @@ from models.networks.architecture import VGG19, InceptionV3
 # but it abstracts away the need to create the target label tensor
 # that has the same size as the input
 class GANLoss(nn.Module):
+    # |tensor|: dtype of the targets, by default float16 or float32
+    # following the precision of the ops around the first call
     def __init__(self, gan_mode, target_real_label=1.0, target_fake_label=0.0,
-                 tensor=jt.float16, opt=None):
+                 tensor=None, opt=None):
         super(GANLoss, self).__init__()
         self.real_label = target_real_label
         self.fake_label = target_fake_label
         self.real_label_tensor = None
         self.fake_label_tensor = None
         self.zero_tensor = None
-        self.Tensor = tensor
+        self.Tensor = tensor if tensor is not None else (lambda value: jt.array(value).float_auto())
         self.gan_mode = gan_mode
         self.opt = opt
         if gan_mode == 'ls':
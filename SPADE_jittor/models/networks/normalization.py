@@ -4,6 +4,7 @@ Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses
 """
 
 import re
+from contextlib import contextmanager
 import numpy as np
 import jittor as jt
 from jittor import init
@@ -20,6 +21,15 @@ from typing import Any, Optional, TypeVar
 from jittor.nn import Module
 
 # jittor SpectralNorm implementation https://discuss.jittor.org/t/topic/194/3
+#
+# In this port the forward pass uses the raw weight: |weight| is the same
+# Var as weight_orig, and the pre-forward hook of the original port computed
+# W / sigma before every forward without assigning it (nor writing u and v
+# back), so jittor never ran it and every model was trained and evaluated
+# with W_orig. The hook is not registered any more, which keeps those
+# numerics and saves building the discarded power iteration and division
+# graph in every forward of every layer (several times per iteration for D).
+# compute_weight() still gives the normalized weight on request.
 class SpectralNorm:
     # Invariant before and after each forward call:
     #   u = normalize(W @ v)
@@ -105,19 +115,16 @@ class SpectralNorm:
         weight = weight / sigma
         return weight
 
+    # keeps the weight the forward pass uses, weight_orig (see above)
     def remove(self, module: Module) -> None:
-        with jittor.no_grad():
-            weight = self.compute_weight(module, do_power_iteration=False)
+        weight = getattr(module, self.name + '_orig')
         delattr(module, self.name)
         delattr(module, self.name + '_u')
         delattr(module, self.name + '_v')
         delattr(module, self.name + '_orig')
+        delattr(module, '_spectral_norm')
         # module.register_parameter(self.name, jittor.Var(weight.detach()))
-        setattr(module, self.name, jittor.Var(weight.detach()))
-
-    def __call__(self, module: Module, inputs: Any) -> None:
-        self.compute_weight(module, do_power_iteration=module.is_training())
-        # setattr(module, self.name, self.compute_weight(module, do_power_iteration=module.training))
+        setattr(module, self.name, weight)
 
     def _solve_v_and_rescale(self, weight_mat, u, target_sigma):
         # Tries to returns a vector `v` s.t. `u = normalize(W @ v)`
@@ -169,7 +176,8 @@ class SpectralNorm:
         setattr(module, fn.name + "_v", v)
 
         # module.register_forward_pre_hook(fn)
-        module.register_pre_forward_hook(fn)
+        # no hook, the forward pass uses weight_orig (see above)
+        module._spectral_norm = fn
         # module._register_state_dict_hook(SpectralNormStateDictHook(fn))
         # module._register_load_state_dict_pre_hook(SpectralNormLoadStateDictPreHook(fn))
         return fn
@@ -303,6 +311,19 @@ def spectral_norm(module: T_module,
     return module
 
 
+# Folds the spectral norm of every layer of |net| for inference: the layers
+# keep the weight their forward pass uses and drop weight_orig, weight_u and
+# weight_v. Returns the number of folded layers.
+def fold_spectral_norm(net):
+    folded = 0
+    for module in net.modules():
+        fn = getattr(module, '_spectral_norm', None)
+        if fn is not None:
+            fn.remove(module)
+            folded += 1
+    return folded
+
+
 
 # Returns a function that creates a normalization function
 # that does not condition on semantic map
@@ -361,7 +382,7 @@ def get_1d_sincos_pos_embed_from_grid(embed_dim, pos):
     out: (M, D)
     """
     assert embed_dim % 2 == 0
-    omega = np.arange(embed_dim // 2, dtype=np.float)
+    omega = np.arange(embed_dim // 2, dtype=np.float64)
     omega /= embed_dim / 2.
     omega = 1. / 10000**omega  # (D/2,)
 
@@ -385,6 +406,308 @@ def get_2d_sincos_pos_embed(embed_dim, grid_h_sz, grid_w_sz):
     pos_embed = get_2d_sincos_pos_embed_from_grid(embed_dim, grid)
     return pos_embed
 
+
+# The positional embeddings of SPADE, shared by all layers of the process
+# and keyed by (C, H, W, dtype), see pos_embed
+_pos_embeds = {}
+
+
+# The sin-cos positional embedding get_2d_sincos_pos_embed(C, H, W) as a
+# (1, C, H, W) constant array of |dtype|, computed once per process. The
+# (H * W, C) embedding is reshaped as is, the layout models were trained
+# with.
+def pos_embed(C, H, W, dtype='float32'):
+    key = (C, H, W, str(dtype))
+    if key not in _pos_embeds:
+        embed = get_2d_sincos_pos_embed(C, H, W).reshape(1, C, H, W)
+        _pos_embeds[key] = jt.array(embed.astype(str(dtype))).stop_grad()
+    return _pos_embeds[key]
+
+# Records the random noise drawn inside SPADE layers while it is active, so
+# that exactly the same noise is used again when the activations of a block
+# are recomputed during backward (see architecture.RecomputeBlock).
+class NoiseTape():
+    def __init__(self):
+        self.noises = []
+        self.position = None
+
+    def replay(self):
+        self.position = 0
+        return self
+
+    def draw(self, shape):
+        if self.position is None:
+            noise = jt.randn(shape)
+            self.noises.append(noise)
+        else:
+            noise = self.noises[self.position]
+            self.position += 1
+        return noise
+
+
+# Noise of K samples for each of B label maps stacked along the batch
+# (sample k of label map b at k * B + b, see split_samples). The noise of
+# sample k of label map b at the n-th draw comes from its own generator,
+# seeded with (seeds[k], keys[b], n): |keys| are B ints identifying the
+# label maps (e.g. a hash of the file name, see generate_variants), so a
+# seed gives the same image of a label map whatever else is in the batch,
+# padding included. Used in place of a NoiseTape through noise_tape().
+class SeededNoise():
+    def __init__(self, seeds, keys):
+        self.seeds = list(seeds)
+        self.keys = list(keys)
+        self.position = 0
+
+    def draw(self, shape):
+        assert shape[0] == len(self.seeds) * len(self.keys), \
+            'batch %d is not %d samples of %d label maps' % (shape[0], len(self.seeds), len(self.keys))
+        sample_shape = (1,) + tuple(shape[1:])
+        noise = np.concatenate([np.random.RandomState([seed, key, self.position]).standard_normal(sample_shape)
+                                for seed in self.seeds for key in self.keys], axis=0)
+        self.position += 1
+        return jt.array(noise.astype(np.float32))
+
+
+_noise_tape = None
+
+
+@contextmanager
+def noise_tape(tape):
+    global _noise_tape
+    previous, _noise_tape = _noise_tape, tape
+    try:
+        yield tape
+    finally:
+        _noise_tape = previous
+
+
+def sample_noise(shape):
+    if _noise_tape is not None:
+        return _noise_tape.draw(shape)
+    return jt.randn(shape)
+
+
+# Converts the weights and biases found under |split_prefixes| in the state
+# dict |weights| to one entry under |fused_prefix|, concatenated along the
+# output channels, or back when |fused| is False. Returns the new entries
+# and the keys they replace, both empty when |weights| has the layout
+# already.
+def convert_fused_weights(weights, fused_prefix, split_prefixes, fused):
+    new_entries, replaced = {}, []
+    for suffix in ('weight', 'bias'):
+        fused_key = fused_prefix + suffix
+        split_keys = [prefix + suffix for prefix in split_prefixes]
+        if fused and fused_key not in weights and all(k in weights for k in split_keys):
+            arrays = [weights[k].numpy() if isinstance(weights[k], jt.Var) else np.asarray(weights[k]) for k in split_keys]
+            new_entries[fused_key] = np.concatenate(arrays, axis=0)
+            replaced += split_keys
+        elif not fused and fused_key in weights and not any(k in weights for k in split_keys):
+            array = weights[fused_key].numpy() if isinstance(weights[fused_key], jt.Var) else np.asarray(weights[fused_key])
+            new_entries.update(zip(split_keys, np.split(array, len(split_keys), axis=0)))
+            replaced.append(fused_key)
+    return new_entries, replaced
+
+
+# Resized copies of the label map of one batch. Pix2PixModel.preprocess_input
+# builds it once per forward and G and D take it in place of the label map,
+# so that every SPADE layer at a resolution (including the noise of
+# --use_seg_noise), the first layer of G and the discriminator scales of the
+# fake and the real half of the batch share one resized map each. A plain
+# label map is wrapped on the fly, see label_pyramid.
+#
+# With |indices|, the (B, 1, H, W) class of every pixel of which the first
+# |num_classes| channels of |labels| are the one-hot encoding, CLADE and the
+# SPADE layers of --index_spade convolve the label map by gathering from it
+# (see label_conv) and the one-hot map is only computed for the layers that read
+# it (jittor leaves unused ops out).
+class LabelPyramid():
+    def __init__(self, labels, indices=None, num_classes=None):
+        self.labels = labels
+        self.indices = indices
+        self.num_classes = num_classes
+        self.levels = {}
+        self.index_levels = {}
+        self.extra_levels = {}
+        self.pooled_maps = [labels]
+
+    @property
+    def num_channels(self):
+        return self.labels.shape[1]
+
+    # the label map resized to |size| with nn.interpolate
+    def resize(self, size, mode='nearest'):
+        return self.level(size, mode).labels
+
+    # the pyramid of the label map resized to |size|
+    def level(self, size, mode='nearest'):
+        size = tuple(size)
+        if size == tuple(self.labels.shape[2:]):
+            return self
+        if (size, mode) not in self.levels:
+            self.levels[(size, mode)] = LabelPyramid(nn.interpolate(self.labels, size=size, mode=mode))
+        return self.levels[(size, mode)]
+
+    # |indices| resized to |size|, the class of every pixel of the one-hot
+    # part of resize(size). Interpolated as float32, which is exact for any
+    # class index.
+    def resize_indices(self, size):
+        size = tuple(size)
+        if size == tuple(self.indices.shape[2:]):
+            return self.indices
+        if size not in self.index_levels:
+            self.index_levels[size] = nn.interpolate(self.indices.float32(), size=size, mode='nearest').int32()
+        return self.index_levels[size]
+
+    # the channels of resize(size) after the one-hot ones, e.g. the instance
+    # edge map, or None
+    def resize_extra(self, size):
+        if self.num_channels == self.num_classes:
+            return None
+        size = tuple(size)
+        if size not in self.extra_levels:
+            extra = self.labels[:, self.num_classes:]
+            if size != tuple(extra.shape[2:]):
+                extra = nn.interpolate(extra, size=size, mode='nearest')
+            self.extra_levels[size] = extra
+        return self.extra_levels[size]
+
+    # the label map after as many |pool| steps as bring it down to |size|,
+    # the downsampling between the scales of MultiscaleDiscriminator
+    def pooled(self, size, pool):
+        size = tuple(size)
+        for label_map in self.pooled_maps:
+            if tuple(label_map.shape[2:]) == size:
+                return label_map
+        while self.pooled_maps[-1].shape[2] > size[0]:
+            self.pooled_maps.append(pool(self.pooled_maps[-1]))
+            if tuple(self.pooled_maps[-1].shape[2:]) == size:
+                return self.pooled_maps[-1]
+        raise ValueError('no downsampling of the %s label map gives %s' % (tuple(self.labels.shape[2:]), size))
+
+
+def label_pyramid(segmap):
+    if isinstance(segmap, LabelPyramid):
+        return segmap
+    return LabelPyramid(segmap)
+
+
+# The convolution |conv| of the label map of |labels| resized to |size|,
+# computed from the class indices of the pyramid. On a one-hot map the
+# convolution at a pixel is the bias plus, for every kernel offset, the
+# kernel column of the class of the pixel at that offset, so it is computed
+# as kh * kw gathers from the weight instead of a convolution over the
+# mostly-zero one-hot channels. The padding pixels, and the pixels whose
+# index is out of [0, num_classes) (scatter_ leaves their one-hot channels
+# at zero), gather a zero column like the dense map contributes nothing
+# there. The other channels of the map (instance edges) go through a
+# regular convolution with their slice of the weight. Summed in float32
+# like the dense convolution accumulates. check_index_spade.py compares it
+# with the dense convolution.
+def label_conv(conv, labels, size):
+    assert conv.stride == (1, 1) and conv.dilation == (1, 1) and conv.groups == 1, \
+        'label_conv only supports stride 1, dilation 1 and one group'
+    num_classes = labels.num_classes
+    out_nc, _, kh, kw = conv.weight.shape
+    ph, pw = conv.padding
+    weight = conv.weight.float32()
+    # (kh, kw, num_classes + 1, out_nc), the last class for the padding
+    table = jt.contrib.concat([weight[:, :num_classes].permute(2, 3, 1, 0),
+                               jt.zeros((kh, kw, 1, out_nc), dtype='float32')], dim=2)
+    indices = labels.resize_indices(size)
+    in_range = ((indices >= 0) & (indices < num_classes)).int32()
+    indices = indices * in_range + num_classes * (1 - in_range)
+    B, _, H, W = indices.shape
+    padded = indices.reindex([B, H + kh - 1, W + kw - 1], ['i0', '0', 'i1-%d' % ph, 'i2-%d' % pw],
+                             overflow_value=num_classes)
+    out = None
+    for i in range(kh):
+        for j in range(kw):
+            term = table[i, j][padded[:, i:i + H, j:j + W]]
+            out = term if out is None else out + term
+    out = out.permute(0, 3, 1, 2)
+    if conv.bias is not None:
+        out = out + conv.bias.float32().reshape((1, out_nc, 1, 1))
+    extra = labels.resize_extra(size)
+    if extra is not None:
+        out = out + nn.conv2d(extra.float32(), weight[:, num_classes:], padding=conv.padding)
+    return out.float_auto()
+
+
+# Views |x|, a batch of K samples for each of |batch| label maps stacked
+# sample after sample (see SPADEGenerator.execute), as (K, batch, ...), so
+# that tensors computed once per label map broadcast over the samples.
+def split_samples(x, batch):
+    return x.reshape((x.shape[0] // batch, batch) + tuple(x.shape[1:]))
+
+
+# |conv| applied to the label map of the LabelPyramid |labels| at |size|,
+# gathered from the class indices when |gather| and the pyramid has them
+def conv_label_map(conv, labels, size, gather=True):
+    if gather and labels.indices is not None:
+        return label_conv(conv, labels, size)
+    return conv(labels.resize(size))
+
+
+# The parameter-free part of SPADE and CLADE: the normalization given by
+# |param_free_norm_type| (syncbatch, batch, instance) of the activations,
+# with the noise of --use_seg_noise or |add_noise| added before it. The
+# convolutions over the label map are gathered from the class indices when
+# |gather|, see label_conv.
+class ConditionalNorm(nn.Module):
+    def __init__(self, param_free_norm_type, norm_nc, label_nc, add_noise=False, opt=None, gather=False):
+        super().__init__()
+
+        if param_free_norm_type == 'instance':
+            self.param_free_norm = nn.InstanceNorm2d(norm_nc, affine=False)
+        elif param_free_norm_type == 'syncbatch':
+            self.param_free_norm = BatchNorm(norm_nc, affine=False, sync=True)
+        elif param_free_norm_type == 'batch':
+            self.param_free_norm = nn.BatchNorm2d(norm_nc, affine=False)
+        else:
+            raise ValueError('%s is not a recognized param-free norm type in %s'
+                             % (param_free_norm_type, type(self).__name__))
+        self.add_noise = add_noise
+        if opt.use_seg_noise:
+            k = opt.use_seg_noise_kernel
+            self.seg_noise_var = nn.Conv2d(label_nc, norm_nc, k, padding=(k-1)//2)
+            init.constant_(self.seg_noise_var.weight, 0.0)
+            init.constant_(self.seg_noise_var.bias, 0.0)
+        if self.add_noise:
+            self.noise_var = nn.Parameter(jt.zeros(norm_nc), requires_grad=True)
+        self.gather = gather
+        self.norm_nc = norm_nc
+        self.opt = opt
+
+    # |conv| applied to the label map of the pyramid |labels| at |size|
+    def conv_labels(self, conv, labels, size):
+        return conv_label_map(conv, labels, size, self.gather)
+
+    # Part 1. generate parameter-free normalized activations. |x| may hold
+    # several samples per label map, the seg noise scale is computed once
+    # per label map.
+    def normalize(self, x, labels, size):
+        if self.opt.use_seg_noise:
+            noise = self.conv_labels(self.seg_noise_var, labels, size)
+            added_noise = sample_noise((x.shape[0], 1, noise.shape[2], noise.shape[3]))
+            if x.shape[0] != noise.shape[0]:
+                added_noise = (split_samples(added_noise, noise.shape[0]) * noise).reshape(x.shape)
+            else:
+                added_noise = added_noise * noise
+            return self.param_free_norm(x + added_noise)
+        elif self.add_noise:
+            added_noise = (sample_noise((x.shape[0], x.shape[3], x.shape[2], 1)) * self.noise_var).transpose(1, 3)
+            return self.param_free_norm(x + added_noise)
+        return self.param_free_norm(x)
+
+    # normalized * (1 + gamma) + beta, with gamma and beta of the label maps
+    # broadcast over the samples of each when |normalized| holds several
+    def modulate(self, normalized, gamma, beta):
+        if normalized.shape[0] == gamma.shape[0]:
+            return normalized * (1 + gamma) + beta
+        out = split_samples(normalized, gamma.shape[0]) * (1 + gamma) + beta
+        return out.reshape(normalized.shape)
+
+
 # Creates SPADE normalization layer based on the given configuration
 # SPADE consists of two steps. First, it normalizes the activations using
 # your favorite normalization method, such as Batch Norm or Instance Norm.
@@ -398,81 +721,148 @@ def get_2d_sincos_pos_embed(embed_dim, grid_h_sz, grid_w_sz):
 # Also, the other arguments are
 # |norm_nc|: the #channels of the normalized activations, hence the output dim of SPADE
 # |label_nc|: the #channels of the input semantic map, hence the input dim of SPADE
-class SPADE(nn.Module):
-    def __init__(self, config_text, norm_nc, label_nc, use_pos=False, use_pos_proj=False, add_noise = False, opt=None):
-        super().__init__()
-
+#
+# With --fused_spade, gamma and beta come from one convolution with twice the
+# output channels, and |shared_input| leaves out mlp_shared: the caller
+# passes the hidden activations, see SPADEResnetBlock.
+class SPADE(ConditionalNorm):
+    def __init__(self, config_text, norm_nc, label_nc, use_pos=False, use_pos_proj=False, add_noise = False, opt=None, shared_input=False):
         assert config_text.startswith('spade')
         parsed = re.search('spade(\D+)(\d)x\d', config_text)
         param_free_norm_type = str(parsed.group(1))
         ks = int(parsed.group(2))
+        super().__init__(param_free_norm_type, norm_nc, label_nc, add_noise, opt, gather=opt.index_spade)
 
-        if param_free_norm_type == 'instance':
-            self.param_free_norm = nn.InstanceNorm2d(norm_nc, affine=False)
-        elif param_free_norm_type == 'syncbatch':
-            self.param_free_norm = BatchNorm(norm_nc, affine=False, sync=True)
-        elif param_free_norm_type == 'batch':
-            self.param_free_norm = nn.BatchNorm2d(norm_nc, affine=False)
-        else:
-            raise ValueError('%s is not a recognized param-free norm type in SPADE'
-                             % param_free_norm_type)
-        self.add_noise = add_noise
         self.use_pos = use_pos
         self.use_pos_proj = use_pos_proj
-        if opt.use_seg_noise:
-            k = opt.use_seg_noise_kernel
-            self.seg_noise_var = nn.Conv2d(label_nc, norm_nc, k, padding=(k-1)//2)
-            init.constant_(self.seg_noise_var.weight, 0.0)
-            init.constant_(self.seg_noise_var.bias, 0.0)
 
         # The dimension of the intermediate embedding space. Yes, hardcoded.
         nhidden = 128
-        if self.add_noise:
-            self.noise_var = nn.Parameter(jt.zeros(norm_nc), requires_grad=True)
-        self.pos_embed = None
         if use_pos_proj:
             self.pos_proj = nn.Conv2d(nhidden, nhidden, kernel_size=1)
+            # pos_proj of the embedding, constant in eval mode
+            self._eval_pos_proj = None
 
         pw = ks // 2
-        self.mlp_shared = nn.Sequential(
-            nn.Conv2d(label_nc, nhidden, kernel_size=ks, padding=pw),
-            nn.ReLU()
-        )
-        self.mlp_gamma = nn.Conv2d(nhidden, norm_nc, kernel_size=ks, padding=pw)
-        self.mlp_beta = nn.Conv2d(nhidden, norm_nc, kernel_size=ks, padding=pw)
-        self.opt = opt
-
-    def execute(self, x, segmap):
-
-        # Part 1. generate parameter-free normalized activations
-        if self.opt.use_seg_noise:
-            seg = nn.interpolate(segmap, size=x.size()[2:], mode='nearest')
-            noise = self.seg_noise_var(seg)
-            added_noise = (jt.randn(noise.shape[0], 1, noise.shape[2], noise.shape[3]) * noise)
-            normalized = self.param_free_norm(x + added_noise)
+        self.nhidden = nhidden
+        self.ks = ks
+        if not shared_input:
+            self.mlp_shared = nn.Sequential(
+                nn.Conv2d(label_nc, nhidden, kernel_size=ks, padding=pw),
+                nn.ReLU()
+            )
+        self.fused = opt.fused_spade
+        if self.fused:
+            self.mlp_gamma_beta = nn.Conv2d(nhidden, 2 * norm_nc, kernel_size=ks, padding=pw)
+        else:
+            self.mlp_gamma = nn.Conv2d(nhidden, norm_nc, kernel_size=ks, padding=pw)
+            self.mlp_beta = nn.Conv2d(nhidden, norm_nc, kernel_size=ks, padding=pw)
+
+    # checkpoints saved with and without --fused_spade load into either.
+    # Checkpoints of older versions saved the positional embedding with the
+    # weights, it is computed instead (see pos_embed).
+    def convert_state_dict(self, weights, prefix):
+        new_entries, replaced = convert_fused_weights(weights, prefix + 'mlp_gamma_beta.',
+                                                      [prefix + 'mlp_gamma.', prefix + 'mlp_beta.'], self.fused)
+        if prefix + 'pos_embed' in weights:
+            replaced.append(prefix + 'pos_embed')
+        return new_entries, replaced
+
+    # computes the positional embedding for activations of |size| ahead of
+    # the first forward, see SPADEGenerator.prepare_pos_embeds
+    def prepare_pos_embed(self, size):
+        if self.use_pos:
+            pos_embed(self.nhidden, size[0], size[1], 'float16' if self.use_pos_proj else 'float32')
+
+    # pos_proj of the float16 positional embedding. In eval mode the
+    # projection is computed once and kept until the next forward in
+    # training mode, when the weights may change.
+    def projected_pos_embed(self, C, H, W):
+        embed = pos_embed(C, H, W, 'float16')
+        if self.is_training():
+            self._eval_pos_proj = None
+            return self.pos_proj(embed)
+        if self._eval_pos_proj is None or tuple(self._eval_pos_proj.shape[2:]) != (H, W):
+            with jt.no_grad():
+                self._eval_pos_proj = self.pos_proj(embed).detach()
+            self._eval_pos_proj.sync()
+        return self._eval_pos_proj
+
+    # mlp_shared (or a convolution and ReLU like it) on the label map
+    def shared_labels(self, mlp_shared, labels, size):
+        if self.gather and labels.indices is not None:
+            return nn.relu(label_conv(mlp_shared[0], labels, size))
+        return mlp_shared(labels.resize(size))
+
+    # |segmap|: label map or LabelPyramid. |actv|: output of mlp_shared
+    # computed by the caller (|shared_input|)
+    def execute(self, x, segmap, actv=None):
+        labels = label_pyramid(segmap)
+        size = x.size()[2:]
+        normalized = self.normalize(x, labels, size)
 
-        elif self.add_noise:
-            added_noise = (jt.randn(x.shape[0], x.shape[3], x.shape[2], 1) * self.noise_var).transpose(1, 3)
-            normalized = self.param_free_norm(x + added_noise)
-        else: 
-            normalized = self.param_free_norm(x)
         # Part 2. produce scaling and bias conditioned on semantic map
-        segmap = nn.interpolate(segmap, size=x.size()[2:], mode='nearest')
-        actv = self.mlp_shared(segmap)
+        if actv is None:
+            actv = self.shared_labels(self.mlp_shared, labels, size)
         if self.use_pos: # default with True
-            if self.pos_embed is None:
-                B, C, H, W = actv.size()
-                pos_embed = jt.from_numpy(get_2d_sincos_pos_embed(C, H, W)).to(actv.device)
-                self.pos_embed = pos_embed.permute(0, 1).reshape(1, C, H, W)
+            B, C, H, W = actv.size()
             if self.use_pos_proj: # default with True
-                actv += self.pos_proj(self.pos_embed.to(jt.float16))
+                actv += self.projected_pos_embed(C, H, W)
             else:
-                actv += self.pos_embed
+                actv += pos_embed(C, H, W)
 
-        gamma = self.mlp_gamma(actv)
-        beta = self.mlp_beta(actv)
+        if self.fused:
+            gamma_beta = self.mlp_gamma_beta(actv)
+            gamma = gamma_beta[:, :self.norm_nc]
+            beta = gamma_beta[:, self.norm_nc:]
+        else:
+            gamma = self.mlp_gamma(actv)
+            beta = self.mlp_beta(actv)
 
         # apply scale and bias
-        out = normalized * (1 + gamma) + beta
-
-        return out
\ No newline at end of file
+        out = self.modulate(normalized, gamma, beta)
+
+        return out
+
+# Class-adaptive normalization (CLADE, https://arxiv.org/abs/2012.04644), a
+# light replacement of SPADE for fast generators: gamma and beta of every
+# channel are looked up per class in learned tables instead of computed by
+# the mlp_shared -> mlp_gamma / mlp_beta convolutions. The format of
+# |config_text| is clade(norm)(ks), where (norm) is the parameter-free
+# normalization as in SPADE and the optional (ks), e.g. cladeinstance3x3,
+# adds a cheap spatial term: a ks x ks convolution of the label map to one
+# scale and one shift map shared by all channels, so that gamma and beta
+# can vary within a class near its borders.
+# The tables are a 1x1 convolution of the one-hot map without bias, looked
+# up from the class indices (see label_conv) when the label map comes with
+# them, as it does from Pix2PixModel.preprocess_input.
+class CLADE(ConditionalNorm):
+    def __init__(self, config_text, norm_nc, label_nc, add_noise=False, opt=None):
+        parsed = re.fullmatch('clade(\D+?)((\d)x\d)?', config_text)
+        if parsed is None:
+            raise ValueError('%s is not a recognized CLADE configuration' % config_text)
+        super().__init__(parsed.group(1), norm_nc, label_nc, add_noise, opt, gather=True)
+        # per-class gamma (the first norm_nc outputs) and beta
+        self.class_gamma_beta = nn.Conv2d(label_nc, 2 * norm_nc, kernel_size=1, bias=False)
+        if parsed.group(3) is not None:
+            ks = int(parsed.group(3))
+            self.spatial_gamma_beta = nn.Conv2d(label_nc, 2, kernel_size=ks, padding=ks // 2)
+        else:
+            self.spatial_gamma_beta = None
+
+    # |segmap|: label map or LabelPyramid. |actv| is not used, CLADE has no
+    # hidden activations to share
+    def execute(self, x, segmap, actv=None):
+        labels = label_pyramid(segmap)
+        size = x.size()[2:]
+        normalized = self.normalize(x, labels, size)
+
+        gamma_beta = self.conv_labels(self.class_gamma_beta, labels, size)
+        gamma = gamma_beta[:, :self.norm_nc]
+        beta = gamma_beta[:, self.norm_nc:]
+        if self.spatial_gamma_beta is not None:
+            spatial = self.conv_labels(self.spatial_gamma_beta, labels, size)
+            gamma = gamma + spatial[:, :1]
+            beta = beta + spatial[:, 1:]
+
+        return self.modulate(normalized, gamma, beta)
@@ -3,12 +3,16 @@ Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
 Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
 """
 
+import os
+import zlib
 import jittor as jt
 from jittor import init
 from jittor import nn
 import models.networks as networks
 import util.util as util
 from util.util import DiffAugment
+from util.amp import PrecisionPolicy
+from models.networks.normalization import LabelPyramid, label_pyramid, SeededNoise, noise_tape, sample_noise, fold_spectral_norm
 
 class Pix2PixModel(nn.Module):
 
@@ -17,21 +21,25 @@ class Pix2PixModel(nn.Module):
         networks.modify_commandline_options(parser, is_train)
         return parser
 
-    def __init__(self, opt):
+    # |warm_start|: the Pix2PixModel of the previous training phase run in
+    # the same process (see train.py). Its weights replace loading
+    # opt.which_epoch from disk and its perceptual loss network is reused.
+    def __init__(self, opt, warm_start=None):
         super().__init__()
         self.opt = opt
-        self.FloatTensor = jt.float16
-        self.netG, self.netD, self.netE = self.initialize_networks(opt)
+        self.precision = PrecisionPolicy(opt)
+        self.netG, self.netD, self.netE = self.initialize_networks(opt, warm_start)
         # set loss functions
         if opt.isTrain:
-            self.criterionGAN = networks.GANLoss(
-                opt.gan_mode, tensor=self.FloatTensor, opt=self.opt)
+            self.criterionGAN = networks.GANLoss(opt.gan_mode, opt=self.opt)
             self.criterionFeat = nn.L1Loss()
             if not opt.no_vgg_loss:
-                if opt.inception_loss:
-                    self.criterionVGG = networks.InceptionLoss(self.opt.gpu_ids)
+                loss_class = networks.InceptionLoss if opt.inception_loss else networks.VGGLoss
+                previous = getattr(warm_start, 'criterionVGG', None)
+                if type(previous) is loss_class:
+                    self.criterionVGG = previous
                 else:
-                    self.criterionVGG = networks.VGGLoss(self.opt.gpu_ids)
+                    self.criterionVGG = loss_class(self.opt.gpu_ids)
             if opt.use_vae:
                 self.KLDLoss = networks.KLDLoss()
 
@@ -79,27 +87,51 @@ class Pix2PixModel(nn.Module):
 
         return optimizer_G, optimizer_D
 
-    def save(self, epoch):
-        util.save_network(self.netG, 'G', epoch, self.opt)
-        util.save_network(self.netD, 'D', epoch, self.opt)
+    # attach |timer| (util.profiler.ForwardTimer) to every network in use
+    def enable_forward_timing(self, timer):
+        self.netG.enable_forward_timing(timer, 'G')
+        if self.netD is not None:
+            self.netD.enable_forward_timing(timer, 'D')
+        if self.netE is not None:
+            self.netE.enable_forward_timing(timer, 'E')
+        if self.opt.isTrain and not self.opt.no_vgg_loss and not self.opt.inception_loss:
+            networks.attach_forward_timer(self.criterionVGG.vgg, timer, 'VGG')
+
+    def disable_forward_timing(self, timer):
+        networks.detach_forward_timer(timer)
+
+    def save(self, epoch, writer=None):
+        util.save_network(self.netG, 'G', epoch, self.opt, writer)
+        util.save_network(self.netD, 'D', epoch, self.opt, writer)
         if self.opt.use_vae:
-            util.save_network(self.netE, 'E', epoch, self.opt)
+            util.save_network(self.netE, 'E', epoch, self.opt, writer)
 
     ############################################################################
     # Private helper methods
     ############################################################################
 
-    def initialize_networks(self, opt):
+    def initialize_networks(self, opt, warm_start=None):
         netG = networks.define_G(opt)
         netD = networks.define_D(opt) if opt.isTrain else None
         netE = networks.define_E(opt) if opt.use_vae else None
 
-        if not opt.isTrain or opt.continue_train:
+        if warm_start is not None:
+            # layers added by the new options keep their initialization,
+            # as when loading a checkpoint saved without them
+            for net, previous in ((netG, warm_start.netG), (netD, warm_start.netD), (netE, warm_start.netE)):
+                if net is not None and previous is not None:
+                    net.load_parameters(net.upgrade_state_dict(previous.state_dict()))
+        elif not opt.isTrain or opt.continue_train:
             netG = util.load_network(netG, 'G', opt.which_epoch, opt)
             if opt.isTrain:
                 netD = util.load_network(netD, 'D', opt.which_epoch, opt)
             if opt.use_vae:
                 netE = util.load_network(netE, 'E', opt.which_epoch, opt)
+        if not opt.isTrain:
+            # inference only needs the weights the forward pass uses
+            for net in (netG, netE):
+                if net is not None:
+                    fold_spectral_norm(net)
         return netG, netD, netE
 
     # preprocess the input, such as moving the tensors to GPUs and
@@ -126,7 +158,9 @@ class Pix2PixModel(nn.Module):
             instance_edge_map = self.get_edges(inst_map)
             input_semantics = jt.contrib.concat((input_semantics, instance_edge_map), dim=1)
         
-        return jt.float_auto(input_semantics), jt.float_auto(data['image'])
+        # resized once per forward for all of G and D, see LabelPyramid. The
+        # SPADE layers of --index_spade and CLADE read the class indices.
+        return LabelPyramid(jt.float_auto(input_semantics), label_map.int32(), nc), jt.float_auto(data['image'])
         
 
     def compute_generator_loss(self, input_semantics, real_image, epoch):
@@ -136,28 +170,31 @@ class Pix2PixModel(nn.Module):
         if (self.opt.use_vae and (KLD_loss is not None)):
             G_losses['KLD'] = KLD_loss
         (pred_fake, pred_real) = self.discriminate(input_semantics, fake_image, real_image, epoch)
-        G_losses['GAN'] = self.criterionGAN(pred_fake, True, for_discriminator=False)
-
-        if (not self.opt.no_ganFeat_loss):
-            num_D = len(pred_fake)
-            GAN_Feat_loss = self.FloatTensor(0)
-            for i in range(num_D):
-                num_intermediate_outputs = (len(pred_fake[i]) - 1)
-                for j in range(num_intermediate_outputs):
-                    unweighted_loss = jt.abs(jt.float32(pred_fake[i][j]-pred_real[i][j].detach())).mean().float_auto()
+        with self.precision.scope('losses'):
+            G_losses['GAN'] = self.criterionGAN(pred_fake, True, for_discriminator=False)
+
+            if (not self.opt.no_ganFeat_loss):
+                num_D = len(pred_fake)
+                GAN_Feat_loss = jt.zeros(1).float_auto()
+                for i in range(num_D):
+                    num_intermediate_outputs = (len(pred_fake[i]) - 1)
+                    for j in range(num_intermediate_outputs):
+                        unweighted_loss = jt.abs(jt.float32(pred_fake[i][j]-pred_real[i][j].detach())).mean().float_auto()
+                
+                        GAN_Feat_loss += ((unweighted_loss * self.opt.lambda_feat) / num_D)
             
-                    GAN_Feat_loss += ((unweighted_loss * self.opt.lambda_feat) / num_D)
-        
-            G_losses['GAN_Feat'] = GAN_Feat_loss
+                G_losses['GAN_Feat'] = GAN_Feat_loss
         if (not self.opt.no_vgg_loss):
             if (type(fake_image) == list):
                 fake_image = fake_image[(- 1)]
             img_shape = fake_image.shape[(- 2):]
             real_image = nn.interpolate(real_image, img_shape)
+            with self.precision.scope('perceptual'):
+                perceptual_loss = self.criterionVGG(fake_image, real_image) * self.opt.lambda_vgg
             if self.opt.inception_loss:
-                G_losses['Inception'] = (self.criterionVGG(fake_image, real_image) * self.opt.lambda_vgg)
+                G_losses['Inception'] = perceptual_loss
             else:
-                G_losses['VGG'] = (self.criterionVGG(fake_image, real_image) * self.opt.lambda_vgg)
+                G_losses['VGG'] = perceptual_loss
         return (G_losses, fake_image)
 
     def compute_discriminator_loss(self, input_semantics, real_image, epoch):
@@ -171,60 +208,118 @@ class Pix2PixModel(nn.Module):
                 with jt.enable_grad():
                     fake_image = fake_image.detach()
         (pred_fake, pred_real) = self.discriminate(input_semantics, fake_image, real_image, epoch)
-        D_losses['D_Fake'] = self.criterionGAN(pred_fake, False, for_discriminator=True)
-        D_losses['D_real'] = self.criterionGAN(pred_real, True, for_discriminator=True)
+        with self.precision.scope('losses'):
+            D_losses['D_Fake'] = self.criterionGAN(pred_fake, False, for_discriminator=True)
+            D_losses['D_real'] = self.criterionGAN(pred_real, True, for_discriminator=True)
         return D_losses
 
     def encode_z(self, real_image):
-        (mu, logvar) = self.netE(real_image)
+        with self.precision.scope('spade'):
+            (mu, logvar) = self.netE(real_image)
         z = self.reparameterize(mu, logvar)
         return (z, mu, logvar)
 
     def encode_m(self, mask):
-        z = self.netE(mask)
+        with self.precision.scope('spade'):
+            z = self.netE(mask)
 
         return z
 
+    # |input_semantics|: label map or LabelPyramid
     def generate_fake(self, input_semantics, real_image, epoch=0, compute_kld_loss=False):
         z = None
         KLD_loss = None
         if self.opt.use_vae:
             if self.opt.encode_mask:
-                z = self.encode_m(input_semantics)
+                z = self.encode_m(label_pyramid(input_semantics).labels)
             else:
                 (z, mu, logvar) = self.encode_z(real_image)
                 if compute_kld_loss:
-                    KLD_loss = (self.KLDLoss(mu, logvar) * self.opt.lambda_kld)
+                    with self.precision.scope('losses'):
+                        KLD_loss = (self.KLDLoss(mu, logvar) * self.opt.lambda_kld)
 
-        fake_image = self.netG(input_semantics, epoch, z=z)
+        with self.precision.scope('spade'):
+            fake_image = self.netG(input_semantics, epoch, z=z)
         assert ((not compute_kld_loss) or self.opt.use_vae), 'You cannot compute KLD loss if opt.use_vae == False'
         return (fake_image, KLD_loss)
 
+    # Generates K variants of every label map of |data| in one batched pass.
+    # The SPADE modulation (gamma, beta and the scale of the seg noise)
+    # only depends on the label map, it is computed once per label map and
+    # broadcast over the variants. The variants differ by their noise
+    # (--use_seg_noise, --add_noise) drawn from |seeds|, K ints, and the
+    # file name of every label map (see SeededNoise; the jittor random
+    # generator without seeds), and with
+    # --use_vae and without --encode_mask by their codes: |z|, (K, z_dim),
+    # one code per variant for the whole batch, else drawn from the seeds.
+    # Returns the images as (K, B, 3, H, W).
+    def generate_variants(self, data, seeds=None, z=None, epoch=0):
+        if seeds is None and z is None:
+            raise ValueError('generate_variants needs noise seeds or z codes')
+        if z is not None and not (self.opt.use_vae and not self.opt.encode_mask):
+            raise ValueError('z codes are only used with --use_vae without --encode_mask')
+        num_samples = len(seeds) if seeds is not None else z.shape[0]
+        if z is not None and z.shape[0] != num_samples:
+            raise ValueError('%d z codes for %d seeds' % (z.shape[0], num_samples))
+
+        input_semantics, real_image = self.preprocess_input(data)
+        batch_size = input_semantics.labels.shape[0]
+        tape = None
+        if seeds is not None:
+            keys = [zlib.crc32(os.path.basename(path).encode('utf-8')) for path in data['path']]
+            tape = SeededNoise(seeds, keys)
+        with jt.no_grad(), noise_tape(tape):
+            codes = None
+            if self.opt.use_vae:
+                if self.opt.encode_mask:
+                    codes = self.encode_m(input_semantics.labels)
+                elif z is not None:
+                    codes = jt.array(z).float32().reshape((num_samples, 1, -1))
+                    codes = codes.broadcast((num_samples, batch_size, codes.shape[2])).reshape((num_samples * batch_size, -1))
+                else:
+                    codes = sample_noise((num_samples * batch_size, self.opt.z_dim))
+            with self.precision.scope('spade'):
+                fake_image = self.netG(input_semantics, epoch, z=codes, num_samples=num_samples)
+        if isinstance(fake_image, list):
+            fake_image = fake_image[-1]
+        return fake_image.reshape((num_samples, batch_size) + tuple(fake_image.shape[1:]))
+
+    # |input_semantics|: label map or LabelPyramid. netD downsamples the label
+    # channels of its input through the pyramid of the labels it is given.
     def discriminate(self, input_semantics, fake_image, real_image, epoch):
+        labels = label_pyramid(input_semantics)
         if (not (type(fake_image) == list)):
             if (len(self.opt.diff_aug) > 0):
-                (real_image, fake_image, input_semantics) = DiffAugment(real_image, fake_image, input_semantics, policy=self.opt.diff_aug)
-            fake_concat = jt.contrib.concat([input_semantics, fake_image], dim=1)
-            real_concat = jt.contrib.concat([input_semantics, real_image], dim=1)
+                (real_image, fake_image, augmented_semantics) = DiffAugment(real_image, fake_image, labels.labels, policy=self.opt.diff_aug)
+                labels = LabelPyramid(augmented_semantics)
+            fake_concat = jt.contrib.concat([labels.labels, fake_image], dim=1)
+            real_concat = jt.contrib.concat([labels.labels, real_image], dim=1)
             fake_and_real = jt.contrib.concat([fake_concat, real_concat], dim=0)
+            D_labels = labels
         else:
             fake_concat = []
             real_concat = []
+            D_labels = None
             for i in range((len(fake_image) - 1), (- 1), (- 1)):
                 if (len(self.opt.diff_aug) > 0):
-                    (generated_image, real_image, input_semantics) = DiffAugment(fake_image[i], real_image, input_semantics, policy=self.opt.diff_aug)
+                    (generated_image, real_image, augmented_semantics) = DiffAugment(fake_image[i], real_image, labels.labels, policy=self.opt.diff_aug)
+                    labels = LabelPyramid(augmented_semantics)
                 else:
                     img_shape = fake_image[i].shape[(- 2):]
-                    input_semantics = nn.interpolate(input_semantics, img_shape)
+                    labels = labels.level(img_shape, mode='bilinear')
                     real_image = nn.interpolate(real_image, img_shape)
                     generated_image = fake_image[i]
-                fake_concat.append(jt.contrib.concat([input_semantics, generated_image], dim=1))
-                real_concat.append(jt.contrib.concat([input_semantics, real_image], dim=1))
+                # the labels of the first input, the one netD downsamples
+                if D_labels is None:
+                    D_labels = labels
+                fake_concat.append(jt.contrib.concat([labels.labels, generated_image], dim=1))
+                real_concat.append(jt.contrib.concat([labels.labels, real_image], dim=1))
             fake_and_real = []
             for i in range(len(fake_concat)):
                 fake_and_real.append(jt.contrib.concat([fake_concat[i], real_concat[i]], dim=0))
    
-        discriminator_out = self.netD(fake_and_real, epoch)
+        with self.precision.scope('D'):
+            discriminator_out = self.netD(fake_and_real, epoch, labels=D_labels)
         (pred_fake, pred_real) = self.divide_pred(discriminator_out)
         return (pred_fake, pred_real)
 
@@ -241,7 +336,7 @@ class Pix2PixModel(nn.Module):
         return (fake, real)
 
     def get_edges(self, t):
-        edge = self.FloatTensor(t.shape).zero_()
+        edge = jt.zeros(t.shape, dtype='bool')
         edge[:, :, :, 1:] = (edge[:, :, :, 1:] | (t[:, :, :, 1:] != t[:, :, :, :(- 1)]))
         edge[:, :, :, :(- 1)] = (edge[:, :, :, :(- 1)] | (t[:, :, :, 1:] != t[:, :, :, :(- 1)]))
         edge[:, :, 1:, :] = (edge[:, :, 1:, :] | (t[:, :, 1:, :] != t[:, :, :(- 1), :]))
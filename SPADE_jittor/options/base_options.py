@@ -7,6 +7,7 @@ import sys
 import argparse
 import os
 from util import util
+from util.distributed import is_main_process
 import models
 import data
 import pickle
@@ -21,6 +22,7 @@ class BaseOptions():
         parser.add_argument('--name', type=str, default='label2img', help='name of the experiment. It decides where to store samples and models')
         parser.add_argument('--USE_AMP', action='store_true', help='enable fp16')
         parser.set_defaults(USE_AMP=False) 
+        parser.add_argument('--amp_policy', type=str, default='spade=fp16,D=fp16,perceptual=fp16,losses=fp32', help='precision of each module family with --USE_AMP: spade, D, perceptual, losses = fp16 | fp32, see util/amp.py')
         parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
         parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
         parser.add_argument('--model', type=str, default='pix2pix', help='which model to use')
@@ -36,6 +38,8 @@ class BaseOptions():
         parser.set_defaults(use_pos_proj=False)
         parser.add_argument('--use_interFeature_pos', action='store_true', help='SPADE use pos_embed projection')
         parser.set_defaults(use_interFeature_pos=False)
+        parser.add_argument('--fused_spade', action='store_true', help='SPADE computes gamma and beta with one convolution, and the two SPADEs of a resnet block that see the same input share their first convolution. Checkpoints of either layout load into both')
+        parser.add_argument('--index_spade', action='store_true', help='the first convolutions of SPADE over the one-hot label map gather the kernel columns of the class of every pixel from the integer label map instead of convolving the one-hot channels. Same weights and results')
         
         # input/output sizes
         parser.add_argument('--batchSize', type=int, default=10, help='input batch size')
@@ -86,7 +90,8 @@ class BaseOptions():
         self.initialized = True
         return parser
 
-    def gather_options(self):
+    # |args|: list of command line arguments, sys.argv[1:] by default
+    def gather_options(self, args=None):
         # initialize parser with basic options
         if not self.initialized:
             parser = argparse.ArgumentParser(
@@ -94,7 +99,7 @@ class BaseOptions():
             parser = self.initialize(parser)
 
         # get the basic options
-        opt, unknown = parser.parse_known_args()
+        opt, unknown = parser.parse_known_args(args)
         print('opt',opt.model,opt)
 
         # modify model-related parser options
@@ -107,14 +112,14 @@ class BaseOptions():
         dataset_option_setter = data.get_option_setter(dataset_mode)
         parser = dataset_option_setter(parser, self.isTrain)
 
-        opt, unknown = parser.parse_known_args()
+        opt, unknown = parser.parse_known_args(args)
 
         # if there is opt_file, load it.
         # The previous default options will be overwritten
         if opt.load_from_opt_file:
             parser = self.update_options_from_file(parser, opt)
 
-        opt = parser.parse_args()
+        opt = parser.parse_args(args)
         self.parser = parser
         return opt
 
@@ -163,13 +168,13 @@ class BaseOptions():
         new_opt = pickle.load(open(file_name + '.pkl', 'rb'))
         return new_opt
 
-    def parse(self, save=False):
+    def parse(self, save=False, args=None):
 
-        opt = self.gather_options()
+        opt = self.gather_options(args)
         opt.isTrain = self.isTrain   # train or test
 
         self.print_options(opt)
-        if opt.isTrain:
+        if opt.isTrain and is_main_process():
             self.save_options(opt)
 
         # Set semantic_nc based on the option.
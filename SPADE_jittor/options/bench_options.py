@@ -0,0 +1,15 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from .tool_options import ToolOptions
+
+
+class BenchOptions(ToolOptions):
+    def initialize(self, parser):
+        ToolOptions.initialize(self, parser)
+        parser.add_argument('--bench_norm_G', type=str, default='', help='comma separated norm_G configurations to compare, e.g. spectralspadesyncbatch3x3,spectralcladesyncbatch,spectralcladesyncbatch3x3. Empty compares --norm_G with its CLADE counterpart')
+        parser.add_argument('--bench_batch', type=int, default=1, help='batch size of the timed inference passes')
+        parser.add_argument('--bench_steps', type=int, default=20, help='number of timed inference passes per configuration, the first one (compilation) is left out')
+        return parser
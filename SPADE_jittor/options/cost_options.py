@@ -0,0 +1,15 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from .tool_options import ToolOptions
+
+
+class CostOptions(ToolOptions):
+    def initialize(self, parser):
+        ToolOptions.initialize(self, parser)
+        parser.add_argument('--cost_batch', type=int, default=1, help='batch size the costs are computed for')
+        parser.add_argument('--cost_per_layer', action='store_true', help='print the per-layer table of every network at every level, not only the totals')
+        parser.add_argument('--cost_csv', type=str, default='', help='if set, write every per-layer row to this csv file')
+        return parser
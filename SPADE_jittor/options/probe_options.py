@@ -0,0 +1,16 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from .tool_options import ToolOptions
+
+
+class ProbeOptions(ToolOptions):
+    def initialize(self, parser):
+        ToolOptions.initialize(self, parser)
+        parser.add_argument('--probe_steps', type=int, default=3, help='number of synthetic G+D steps run for every candidate batch size')
+        parser.add_argument('--probe_max_batch', type=int, default=64, help='largest batch size tried')
+        parser.add_argument('--probe_mem_budget', type=float, default=0, help='device memory budget in GB, a batch size using more counts as failed. 0 means until out of memory')
+        parser.add_argument('--probe_out', type=str, default='', help='if set, write the largest safe batch size per phase to this json file')
+        return parser
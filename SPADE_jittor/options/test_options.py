@@ -15,6 +15,7 @@ class TestOptions(BaseOptions):
         parser.add_argument('--which_epoch', type=str, default='avg_273_299', help='which epoch to load? set to latest to use latest cached model')
         parser.add_argument('--how_many', type=int, default=float("inf"), help='how many test images to run')
         parser.add_argument('--use_pure', action='store_true', help='use train set image replacement for pure label images')
+        parser.add_argument('--variant_seeds', type=str, default='', help='comma separated noise seeds, e.g. 0,1,2: writes one image [name]_[seed].jpg per seed and label map, generated in one batched pass')
         parser.set_defaults(use_seg_noise=True)
         parser.set_defaults(preprocess_mode='scale_width_and_crop', crop_size=256, load_size=256, display_winsize=256)
         parser.set_defaults(serial_batches=True)
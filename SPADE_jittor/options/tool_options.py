@@ -0,0 +1,14 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from .train_options import TrainOptions
+
+
+# Options of the command line tools that build the networks with the
+# training options (arch_cost.py, probe_batch.py, warmup.py, bench_norm.py).
+# They do not start an experiment: the checkpoint dir is left untouched.
+class ToolOptions(TrainOptions):
+    def save_options(self, opt):
+        pass
@@ -17,10 +17,17 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--no_html', action='store_true', help='do not save intermediate training results to [opt.checkpoints_dir]/[opt.name]/web/')
         parser.add_argument('--debug', action='store_true', help='only do one epoch and displays at each iteration')
         parser.add_argument('--tf_log', action='store_true', help='if specified, use tensorboard logging. Requires tensorflow installed')
+        parser.add_argument('--profile', action='store_true', help='record per-phase timings of each training iteration (adds device syncs)')
+        parser.add_argument('--profile_window', type=int, default=200, help='number of recent iterations used for the rolling profile percentiles')
+        parser.add_argument('--profile_modules', type=int, default=0, help='if > 0, time the forward of every SPADE / resnet block / D scale / VGG slice for this many iterations and write a hot-spot table and a Chrome trace')
+        parser.add_argument('--profile_modules_start', type=int, default=10, help='iteration at which module timing starts (skips kernel compilation)')
 
         # for training
         parser.add_argument('--continue_train', action='store_true', help='continue training: load the latest model')
         parser.add_argument('--which_epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
+        parser.add_argument('--ckpt_format', type=str, default='pkl', help='pkl | tensors. tensors writes flat files that are memory-mapped and loaded lazily (see util/tensor_file.py)')
+        parser.add_argument('--async_save', action='store_true', help='copy the weights to host memory and write checkpoints from a background thread')
+        parser.add_argument('--no_train_state', action='store_true', help='do not save / restore the optimizer, learning rate, RNG and data order with the checkpoints')
         parser.add_argument('--niter', type=int, default=180, help=' # of iter at starting learning rate. This is NOT the total #epochs. Totla #epochs is niter*(growiong resolution scales) + fade_in_epochs*(growiong resolution scales -1) + niter_decay') 
         parser.add_argument('--pg_niter', type=int, default=180, help='# of iter uses mid supervision D') 
         parser.add_argument('--niter_decay', type=int, default=0, help=' # of iter to linearly decay learning rate to zero')
@@ -46,6 +53,19 @@ class TrainOptions(BaseOptions):
 
         parser.add_argument('--lr', type=float, default=0.0002, help='initial learning rate for adam')
         parser.add_argument('--D_steps_per_G', type=int, default=1, help='number of discriminator iterations per generator iterations.')
+        parser.add_argument('--ema_decay', type=float, default=0, help='if > 0, keep an exponential moving average of the generator (and encoder) weights with this decay, saved as [epoch]_ema')
+        parser.add_argument('--ema_start_epoch', type=int, default=0, help='epoch at which the moving average starts, before it the average follows the weights')
+        parser.add_argument('--no_loss_scaling', action='store_true', help='with --USE_AMP, do not scale the losses; no step is skipped on overflow')
+        parser.add_argument('--loss_scale', type=float, default=2.0**15, help='initial dynamic loss scale with --USE_AMP')
+        parser.add_argument('--loss_scale_window', type=int, default=2000, help='steps without overflow after which the loss scale doubles')
+        parser.add_argument('--accum_steps', type=int, default=1, help='split every batch into this many micro-batches and accumulate their gradients before one optimizer step. Each micro-batch runs before the next one, so only the activations of one micro-batch are held. probe_batch.py with this flag compares the peak memory with accum_steps 1')
+
+        # for FID during training, see util/fid_monitor.py
+        parser.add_argument('--fid_freq', type=int, default=0, help='if > 0, compute the FID of the generator on held-out training images every fid_freq epochs')
+        parser.add_argument('--fid_num_images', type=int, default=200, help='number of training images held out of training for the FID')
+        parser.add_argument('--fid_batchSize', type=int, default=0, help='batch size of the FID generation, 0 uses --batchSize')
+        parser.add_argument('--fid_best_k', type=int, default=0, help='if > 0, keep the checkpoints of the k best FID evaluations as [epoch]_fid')
+        parser.add_argument('--fid_patience', type=int, default=0, help='if > 0, stop training after this many FID evaluations without a new best')
 
         # for discriminators
         parser.add_argument('--ndf', type=int, default=64, help='# of discrim filters in first conv layer')
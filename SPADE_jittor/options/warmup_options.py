@@ -0,0 +1,15 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from .tool_options import ToolOptions
+
+
+class WarmupOptions(ToolOptions):
+    def initialize(self, parser):
+        ToolOptions.initialize(self, parser)
+        parser.add_argument('--warmup_steps', type=int, default=2, help='synthetic G+D steps run for every graph, the first one compiles')
+        parser.add_argument('--warmup_test_batchSize', type=str, default='', help='comma separated batch sizes test.py will run with, default --batchSize')
+        parser.add_argument('--warmup_no_test', action='store_true', help='only compile the training kernels')
+        return parser
@@ -0,0 +1,109 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+import json
+import jittor as jt
+from options.probe_options import ProbeOptions
+from trainers.pix2pix_trainer import Pix2PixTrainer
+from util.batch_probe import run_train_steps, run_inference_steps, find_max_batch, release_memory
+from util.synthetic import pg_level_epochs
+jt.flags.use_cuda = 1
+jt.flags.use_stat_allocator = 1
+
+# Finds the largest batch size that fits on the device for every
+# progressive growing level and for inference, with the real training
+# options (same flags as train_phase.py), e.g.
+#   python probe_batch.py --num_D 4 --use_seg_noise --inception_loss --probe_mem_budget 22
+# With --recompute_up every training level is probed a second time with all
+# activations stored, to compare memory and throughput of the recomputation.
+# With --accum_steps K > 1 it is probed a second time without splitting the
+# batch (accum_steps 1), to compare the largest batch, memory and throughput
+# of the gradient accumulation.
+
+opt = ProbeOptions().parse()
+if opt.USE_AMP:
+    jt.flags.auto_mixed_precision_level = 5
+
+trainer = Pix2PixTrainer(opt)
+budget = opt.probe_mem_budget * 2**30
+netG = trainer.pix2pix_model.netG
+results = {}
+comparisons = []
+accum_comparisons = []
+
+# levels are probed in training order, the generator drops its
+# intermediate heads once it reaches the full resolution
+for level, epoch in pg_level_epochs(opt):
+    print('probing training at %s (epoch %d)' % (level, epoch))
+    best = find_max_batch(lambda bs: run_train_steps(trainer, opt, epoch, bs, opt.probe_steps),
+                          opt.probe_max_batch, budget)
+    results['train_' + level] = best
+    if len(opt.recompute_up) > 0:
+        print('probing training at %s without recomputation' % level)
+        netG.set_recompute([])
+        stored = find_max_batch(lambda bs: run_train_steps(trainer, opt, epoch, bs, opt.probe_steps),
+                                opt.probe_max_batch, budget)
+        results['train_%s_stored' % level] = stored
+        netG.set_recompute(opt.recompute_up)
+        if stored is not None:
+            batch_size, stored_peak, stored_time = stored
+            peak, step_time = run_train_steps(trainer, opt, epoch, batch_size, opt.probe_steps)
+            release_memory()
+            comparisons.append((level, batch_size, stored_peak, peak, stored_time, step_time))
+    if opt.accum_steps > 1:
+        print('probing training at %s without gradient accumulation' % level)
+        accum_steps, opt.accum_steps = opt.accum_steps, 1
+        unsplit = find_max_batch(lambda bs: run_train_steps(trainer, opt, epoch, bs, opt.probe_steps),
+                                 opt.probe_max_batch, budget)
+        results['train_%s_unsplit' % level] = unsplit
+        if unsplit is not None and best is not None:
+            # both at the largest batch size that fits either way
+            batch_size = min(unsplit[0], best[0])
+            unsplit_peak, unsplit_time = run_train_steps(trainer, opt, epoch, batch_size, opt.probe_steps)
+            release_memory()
+            opt.accum_steps = accum_steps
+            peak, step_time = run_train_steps(trainer, opt, epoch, batch_size, opt.probe_steps)
+            release_memory()
+            accum_comparisons.append((level, batch_size, unsplit_peak, peak, unsplit_time, step_time))
+        opt.accum_steps = accum_steps
+
+print('probing inference')
+final_epoch = pg_level_epochs(opt)[-1][1]
+best = find_max_batch(lambda bs: run_inference_steps(trainer.pix2pix_model, opt, final_epoch, bs, opt.probe_steps),
+                      opt.probe_max_batch, budget)
+results['inference'] = best
+
+print('\n{:<16} {:>10} {:>10} {:>10} {:>10}'.format('phase', 'max batch', 'mem(MB)', 's/step', 'img/s'))
+for phase, best in results.items():
+    if best is None:
+        print('{:<16} {:>10}'.format(phase, 'none'))
+    else:
+        batch_size, peak, step_time = best
+        print('{:<16} {:>10d} {:>10.0f} {:>10.3f} {:>10.1f}'.format(
+            phase, batch_size, peak / 2**20, step_time, batch_size / step_time))
+
+if len(comparisons) > 0:
+    print('\nrecompute_up=%s at the same batch size' % opt.recompute_up)
+    print('{:<8} {:>6} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8}'.format(
+        'level', 'batch', 'stored(MB)', 'recomp(MB)', 'memory', 'stored(s)', 'recomp(s)', 'speed'))
+    for level, batch_size, stored_peak, peak, stored_time, step_time in comparisons:
+        print('{:<8} {:>6d} {:>12.0f} {:>12.0f} {:>7.0f}% {:>12.3f} {:>12.3f} {:>7.0f}%'.format(
+            level, batch_size, stored_peak / 2**20, peak / 2**20, 100.0 * peak / stored_peak,
+            stored_time, step_time, 100.0 * stored_time / step_time))
+
+if len(accum_comparisons) > 0:
+    print('\naccum_steps=%d against 1 at the same batch size' % opt.accum_steps)
+    print('{:<8} {:>6} {:>12} {:>12} {:>8} {:>12} {:>12} {:>8}'.format(
+        'level', 'batch', 'unsplit(MB)', 'accum(MB)', 'memory', 'unsplit(s)', 'accum(s)', 'speed'))
+    for level, batch_size, unsplit_peak, peak, unsplit_time, step_time in accum_comparisons:
+        print('{:<8} {:>6d} {:>12.0f} {:>12.0f} {:>7.0f}% {:>12.3f} {:>12.3f} {:>7.0f}%'.format(
+            level, batch_size, unsplit_peak / 2**20, peak / 2**20, 100.0 * peak / unsplit_peak,
+            unsplit_time, step_time, 100.0 * unsplit_time / step_time))
+
+if len(opt.probe_out) > 0:
+    with open(opt.probe_out, 'w') as out_file:
+        json.dump({phase: None if best is None else
+                   {'batch_size': best[0], 'memory_mb': best[1] / 2**20, 'seconds_per_step': best[2]}
+                   for phase, best in results.items()}, out_file, indent=2)
+    print('written to %s' % opt.probe_out)
@@ -39,34 +39,47 @@ if opt.use_pure:
 for i, data_i in enumerate(dataloader):
     if i * opt.batchSize >= opt.how_many:
         break
-    generated = model(data_i, mode='inference')
+    # the last batch is padded to the full batch size, see data.pad_batch
+    data_i, num_images = data.pad_batch(data_i, opt.batchSize)
+    # with --variant_seeds, one image per seed and label map, the SPADE
+    # modulation computed once per label map, see generate_variants
+    if len(opt.variant_seeds) > 0:
+        seeds = [int(seed) for seed in opt.variant_seeds.split(',')]
+        variants = model.generate_variants(data_i, seeds=seeds)
+        outputs = [(variants[k], '_%d' % seed) for k, seed in enumerate(seeds)]
+    else:
+        outputs = [(model(data_i, mode='inference'), '')]
     img_path = data_i['path']
-    for b in range(generated.shape[0]):
-        generated_img = generated[b].detach().float().numpy()
-        generated_img = (np.transpose(generated_img, (1, 2, 0)) + 1) / 2.0 * 255.0
-        generated_img = generated_img.astype(np.uint8)
-        if opt.use_pure:
-            label_map =np.transpose(np.array(data_i['label'][b]).astype("uint8"), (1, 2, 0)) 
-            if len(label_map.shape)>2:
-                label_map = label_map[:,:,0]
-            img_shape = label_map.shape
-            label_map = label_map.flatten() 
-            max_label = np.argmax(np.bincount(label_map))
-            max_per = np.count_nonzero(label_map==max_label) / len(label_map)
+    # the variants of an image take the same replacement
+    pure_refs = {}
+    for generated, suffix in outputs:
+        for b in range(num_images):
+            generated_img = generated[b].detach().float().numpy()
+            generated_img = (np.transpose(generated_img, (1, 2, 0)) + 1) / 2.0 * 255.0
+            generated_img = generated_img.astype(np.uint8)
+            if opt.use_pure:
+                label_map =np.transpose(np.array(data_i['label'][b]).astype("uint8"), (1, 2, 0)) 
+                if len(label_map.shape)>2:
+                    label_map = label_map[:,:,0]
+                img_shape = label_map.shape
+                label_map = label_map.flatten() 
+                max_label = np.argmax(np.bincount(label_map))
+                max_per = np.count_nonzero(label_map==max_label) / len(label_map)
 
-            if max_per>0.98:
-                label_map = label_map.reshape(img_shape)
-                train_img_mask = np.ones(img_shape)
-                train_gen_mask = np.ones(img_shape)
-                train_img_mask[label_map!=max_label]=0
-                train_gen_mask[label_map==max_label]=0
+                if max_per>0.98:
+                    label_map = label_map.reshape(img_shape)
+                    train_img_mask = np.ones(img_shape)
+                    train_gen_mask = np.ones(img_shape)
+                    train_img_mask[label_map!=max_label]=0
+                    train_gen_mask[label_map==max_label]=0
 
-                ref_img = ref_dic[max_label].pop()
-                ref_img = np.array(ref_img).astype("uint8")
-                generated_img = np_multi(train_gen_mask, generated_img) + np_multi(train_img_mask,ref_img)  
+                    if b not in pure_refs:
+                        pure_refs[b] = np.array(ref_dic[max_label].pop()).astype("uint8")
+                    ref_img = pure_refs[b]
+                    generated_img = np_multi(train_gen_mask, generated_img) + np_multi(train_img_mask,ref_img)  
 
-        short_path = ntpath.basename(img_path[b:(b + 1)][0])
-        name = os.path.splitext(short_path)[0]
-        image_name = os.path.join('%s.jpg' % (name))
-        save_path = os.path.join(opt.out_path, image_name)
-        save_image(generated_img, save_path, create_dir=True, is_img = True)
+            short_path = ntpath.basename(img_path[b:(b + 1)][0])
+            name = os.path.splitext(short_path)[0]
+            image_name = os.path.join('%s%s.jpg' % (name, suffix))
+            save_path = os.path.join(opt.out_path, image_name)
+            save_image(generated_img, save_path, create_dir=True, is_img = True)
@@ -1,10 +1,74 @@
 # later to rename this file as train.py
 import argparse
-import os
-parser = argparse.ArgumentParser(
-                formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument('--input_path', type=str, default='../../', help='enable training with an image encoder to encode mask.')
-opt, unknown = parser.parse_known_args()
-print(opt.input_path)
-os.system('python train_phase.py --input_path=%s --batchSize=10 --niter=180 --pg_niter=180 --pg_strategy=1 --num_D=4' % opt.input_path)
-os.system("python train_phase.py --input_path=%s --batchSize=5 --niter=340 --pg_niter=180 --pg_strategy=1 --num_D=4 --save_epoch_freq=5 --diff_aug='color,crop,translation' --inception_loss --use_seg_noise --continue_train --which_epoch=180" % opt.input_path)
+import json
+import jittor as jt
+from options.train_options import TrainOptions
+from train_phase import train
+
+# The training recipe: phases run one after the other, each with the options
+# it sets on top of the command line of train.py (a value of True is a flag).
+# They run in one process: the dataset, the loss networks and the compiled
+# kernels stay loaded, and a phase that continues from the last epoch of the
+# previous one (--continue_train with that --which_epoch, or latest) takes
+# its weights from memory instead of reloading the checkpoint.
+PHASES = [
+    {'batchSize': 10, 'niter': 180, 'pg_niter': 180, 'pg_strategy': 1, 'num_D': 4},
+    {'batchSize': 5, 'niter': 340, 'pg_niter': 180, 'pg_strategy': 1, 'num_D': 4, 'save_epoch_freq': 5,
+     'diff_aug': 'color,crop,translation', 'inception_loss': True, 'use_seg_noise': True,
+     'continue_train': True, 'which_epoch': 180},
+]
+
+
+def phase_args(overrides):
+    args = []
+    for k, v in overrides.items():
+        if v is True:
+            args.append('--%s' % k)
+        elif v is not False and v is not None:
+            args.append('--%s=%s' % (k, v))
+    return args
+
+
+# whether the phase with options |opt| continues from the weights the
+# previous phase ended with
+def continues_previous(opt, previous_opt):
+    last_epoch = previous_opt.niter + previous_opt.niter_decay
+    return opt.continue_train and opt.name == previous_opt.name and \
+        opt.checkpoints_dir == previous_opt.checkpoints_dir and \
+        str(opt.which_epoch) in ('latest', str(last_epoch))
+
+
+def run_phases(phases, common_args, start_phase=0):
+    dataloader = None
+    trainer = None
+    previous_opt = None
+    for i, overrides in enumerate(phases):
+        if i < start_phase:
+            continue
+        args = phase_args(overrides) + common_args
+        print('phase %d of %d: %s' % (i + 1, len(phases), ' '.join(args)))
+        opt = TrainOptions().parse(args=args)
+        warm_start = trainer if previous_opt is not None and continues_previous(opt, previous_opt) else None
+        new_trainer, dataloader = train(opt, dataloader, warm_start)
+        # the previous networks are only needed to build the new ones
+        del trainer, warm_start
+        jt.gc()
+        trainer = new_trainer
+        previous_opt = opt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input_path', type=str, default='../../', help='enable training with an image encoder to encode mask.')
+    parser.add_argument('--phases', type=str, default=None, help='json file with a list of phases, each a dict of options, replaces the default recipe')
+    parser.add_argument('--start_phase', type=int, default=1, help='phase to start from, e.g. 2 with --which_epoch=latest to resume the second phase')
+    opt, unknown = parser.parse_known_args()
+    print(opt.input_path)
+    phases = PHASES
+    if opt.phases is not None:
+        with open(opt.phases) as f:
+            phases = json.load(f)
+    # options not known to this script are passed on to every phase and
+    # take precedence over the ones of the phases
+    run_phases(phases, ['--input_path=%s' % opt.input_path] + unknown, opt.start_phase - 1)
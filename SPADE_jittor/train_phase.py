@@ -10,6 +10,10 @@ from collections import OrderedDict
 from options.train_options import TrainOptions
 import data
 from util.iter_counter import IterationCounter
+from util.profiler import StepProfiler, ForwardTimer
+from util.train_state import TerminationHandler, sampler_state, set_sampler_state, set_start_batch
+from util.distributed import is_main_process, barrier, any_rank, replica_divergence
+from util.fid_monitor import FIDMonitor
 from util.visualizer import Visualizer
 from trainers.pix2pix_trainer import Pix2PixTrainer
 import os
@@ -17,89 +21,188 @@ from tensorboardX import SummaryWriter
 from util.util import *
 import shutil 
 os.environ['CUDA_LAUNCH_BLOCKING'] = '1'
-jt.flags.use_cuda = 1
 
-opt = TrainOptions().parse()
-if opt.USE_AMP:
-    jt.flags.auto_mixed_precision_level = 5
-writer = SummaryWriter(os.path.join(opt.checkpoints_dir, opt.name))
-print(' '.join(sys.argv))
 
+# Trains one phase with the options |opt|. |dataloader| and |warm_start|
+# (the trainer of the previous phase, which holds opt.which_epoch) come from
+# a previous phase run in the same process, see train.py. Returns the
+# trainer and the dataloader for the next phase.
+def train(opt, dataloader=None, warm_start=None):
+    # --gpu_ids=-1 trains on the CPU, e.g. several processes under mpirun
+    jt.flags.use_cuda = 1 if jt.has_cuda and len(opt.gpu_ids) > 0 else 0
+    if opt.USE_AMP:
+        jt.flags.auto_mixed_precision_level = 5
+    if jt.in_mpi:
+        assert opt.batchSize % jt.world_size == 0, \
+            'Batch size %d must be a multiple of the number of MPI processes %d' % (opt.batchSize, jt.world_size)
+        print('rank %d of %d, %d images per rank and batch' % (jt.rank, jt.world_size, opt.batchSize // jt.world_size))
+    # only rank 0 writes logs and files, see util/distributed.py
+    writer = SummaryWriter(os.path.join(opt.checkpoints_dir, opt.name)) if is_main_process() else None
 
-opt.label_dir = get_gray_label(opt.input_path,for_test=False)
+    if is_main_process():
+        opt.label_dir = get_gray_label(opt.input_path,for_test=False)
+    barrier()
+    if not is_main_process():
+        opt.label_dir = get_gray_label(opt.input_path,for_test=False)
 
-dataloader = data.create_dataloader(opt)
+    if dataloader is None:
+        dataloader = data.create_dataloader(opt)
+    else:
+        dataloader = data.reuse_dataloader(dataloader, opt)
+    # holds its images out of the dataloader, on every rank
+    fid_monitor = FIDMonitor(opt, dataloader) if opt.fid_freq > 0 else None
 
-trainer = Pix2PixTrainer(opt)
-iter_counter = IterationCounter(opt, len(dataloader))
-visualizer = Visualizer(opt)
-print_sample_num = 8
+    trainer = Pix2PixTrainer(opt, warm_start)
+    iter_counter = IterationCounter(opt, len(dataloader))
+    resume = trainer.resume_progress
+    if resume is not None:
+        iter_counter.resume(resume['epoch'], resume['epoch_iter'])
+    termination = TerminationHandler()
+    visualizer = Visualizer(opt) if is_main_process() else None
+    profiler = StepProfiler(opt)
+    module_timer = None
+    modules_timed_iters = 0
+    print_sample_num = 8
 
-glb_GAN_Feat_loss = 100
-glb_VGG_loss = 100
-glb_GAN_Feat_perceptual = 100
+    glb_GAN_Feat_loss = 100
+    glb_VGG_loss = 100
+    glb_GAN_Feat_perceptual = 100
 
+    stat_save_path = os.path.join(opt.checkpoints_dir, opt.name)
+    if is_main_process():
+        get_pure_ref_dics(opt.image_dir,opt.label_dir,stat_save_path)
 
-stat_save_path = os.path.join(opt.checkpoints_dir, opt.name)
-get_pure_ref_dics(opt.image_dir,opt.label_dir,stat_save_path)
+    for epoch in iter_counter.training_epochs():
+        ep_acc_GAN_Feat_loss = 0
+        ep_acc_VGG_loss = 0
+        ep_acc_GAN_Feat_perceptual = 0
 
-for epoch in iter_counter.training_epochs():
-    ep_acc_GAN_Feat_loss = 0
-    ep_acc_VGG_loss = 0
-    ep_acc_GAN_Feat_perceptual = 0
+        # a run resumed mid-epoch replays the data order of that epoch and
+        # starts after the batches it already trained on, without loading them
+        skip_batches = 0
+        if resume is not None and epoch == resume['epoch']:
+            set_sampler_state(dataloader, resume['sampler'])
+            skip_batches = resume['epoch_iter'] // opt.batchSize
+        set_start_batch(dataloader, skip_batches)
+        epoch_sampler = sampler_state(dataloader)
+        iter_counter.record_epoch_start(epoch, skip_batches * opt.batchSize)
+        profiler.record_epoch_start(epoch)
+        iter_ct = 0
+        stop = False
+        for (i, data_i) in enumerate(dataloader, skip_batches):
+            # print('iter ',i)
+            profiler.record_data()
+            iter_counter.record_one_iteration()
+            if jt.rank==0 and opt.profile_modules > 0 and module_timer is None and iter_ct == opt.profile_modules_start:
+                module_timer = ForwardTimer()
+                trainer.enable_forward_timing(module_timer)
+            # print('data_i is ok', data_i['label'][0][0][0])
+            if ((i % opt.D_steps_per_G) == 0):
+                with profiler.phase('G'):
+                    trainer.run_generator_one_step(data_i, epoch)
+            # print('data_i is ok', data_i['label'])
+            with profiler.phase('D'):
+                trainer.run_discriminator_one_step(data_i, epoch)
+            with profiler.phase('log'):
+                # averaged over the ranks, computed on every rank
+                losses = trainer.get_latest_losses()
+                loss_names = ['GAN', 'GAN_Feat', 'VGG', 'D_Fake', 'D_real']
+                ct = 0
+                for (k, v) in losses.items():
+                    v = v.mean().float()
+                    if writer is not None:
+                        writer.add_scalar(loss_names[ct], v.item(), (epoch - 1) * len(dataloader) + i)
+                    ct += 1
+                if jt.rank==0 and iter_counter.needs_printing():
+                    visualizer.print_current_errors(epoch, iter_counter.epoch_iter, losses, iter_counter.time_per_iter)
+                    visualizer.plot_current_errors(losses, iter_counter.total_steps_so_far)
+                    profiler.print_current_percentiles()
+                if jt.rank==0 and iter_counter.needs_displaying():
+                    visuals = OrderedDict([('synthesized_image', trainer.get_latest_generated()[:print_sample_num]), ('real_image', data_i['image'][:print_sample_num])])
+                    visualizer.display_current_results(visuals, epoch, iter_counter.total_steps_so_far)
+            if jt.rank==0 and iter_counter.needs_saving():
+                print(('saving the latest model (epoch %d, total_steps %d)' % (epoch, iter_counter.total_steps_so_far)))
+                with profiler.phase('save'):
+                    trainer.save('latest', {'epoch': epoch, 'epoch_iter': iter_counter.epoch_iter, 'sampler': epoch_sampler})
+                iter_counter.record_current_iter()
+            if jt.rank==0 and epoch>opt.pg_niter:
+                ct = 0
+                for (k, v) in losses.items():
+                    if ct==1:
+                        GAN_Feat = v.mean().float()
+                    if ct==2:
+                        VGG_loss = v.mean().float()
+                    ct += 1
+                ep_acc_GAN_Feat_loss += GAN_Feat
+                ep_acc_VGG_loss += VGG_loss
+                ep_acc_GAN_Feat_perceptual += GAN_Feat + 5.0*VGG_loss
+            if module_timer is not None and modules_timed_iters < opt.profile_modules:
+                modules_timed_iters += 1
+                if modules_timed_iters == opt.profile_modules:
+                    trainer.disable_forward_timing(module_timer)
+                    header = 'Module forward times over %d iterations (epoch %d, crop_size %d, ngf %d, batchSize %d)\n' % \
+                        (modules_timed_iters, epoch, opt.crop_size, opt.ngf, opt.batchSize)
+                    hot_spots = module_timer.format_hot_spots(header)
+                    print(hot_spots)
+                    with open(os.path.join(opt.checkpoints_dir, opt.name, 'module_hotspots.txt'), 'w') as hot_spot_file:
+                        hot_spot_file.write(hot_spots)
+                    module_timer.save_chrome_trace(os.path.join(opt.checkpoints_dir, opt.name, 'module_trace.json'))
+            iter_ct+=1
+            jt.sync_all(True)
+            profiler.record_iteration_end()
+            # every rank stops at the same iteration, whichever got SIGTERM
+            stop = any_rank(termination.requested)
+            if stop:
+                break
+        if stop:
+            if jt.rank==0:
+                print('saving the latest model before exiting (epoch %d, total_steps %d)' % (epoch, iter_counter.total_steps_so_far))
+                trainer.save('latest', {'epoch': epoch, 'epoch_iter': iter_counter.epoch_iter, 'sampler': epoch_sampler})
+                trainer.wait_for_saves()
+                iter_counter.record_current_iter()
+            sys.exit(0)
+        trainer.update_learning_rate(epoch)
+        iter_counter.record_epoch_end()
+        loss_scale_report = trainer.loss_scale_report()
+        if jt.rank==0 and loss_scale_report is not None:
+            print('mixed precision: %s' % loss_scale_report)
+        if jt.in_mpi:
+            divergence = replica_divergence(trainer.pix2pix_model.netG)
+            if jt.rank==0:
+                print('replicas of G across %d ranks differ by %g' % (jt.world_size, divergence))
 
-    iter_counter.record_epoch_start(epoch)
-    iter_ct = 0
-    for (i, data_i) in enumerate(dataloader, start=iter_counter.epoch_iter):
-        # print('iter ',i)
-        iter_counter.record_one_iteration()
-        # print('data_i is ok', data_i['label'][0][0][0])
-        if ((i % opt.D_steps_per_G) == 0):
-            trainer.run_generator_one_step(data_i, epoch)
-        # print('data_i is ok', data_i['label'])
-        trainer.run_discriminator_one_step(data_i, epoch)
-        losses = trainer.get_latest_losses()
-        loss_names = ['GAN', 'GAN_Feat', 'VGG', 'D_Fake', 'D_real']
-        ct = 0
-        for (k, v) in losses.items():
-            v = v.mean().float()
-            writer.add_scalar(loss_names[ct], v.item(), (epoch - 1) * len(dataloader) + i)
-            ct += 1
-        if jt.rank==0 and iter_counter.needs_printing():
-            losses = trainer.get_latest_losses()
-            visualizer.print_current_errors(epoch, iter_counter.epoch_iter, losses, iter_counter.time_per_iter)
-            visualizer.plot_current_errors(losses, iter_counter.total_steps_so_far)
-        if jt.rank==0 and iter_counter.needs_displaying():
-            visuals = OrderedDict([('synthesized_image', trainer.get_latest_generated()[:print_sample_num]), ('real_image', data_i['image'][:print_sample_num])])
-            visualizer.display_current_results(visuals, epoch, iter_counter.total_steps_so_far)
-        if jt.rank==0 and iter_counter.needs_saving():
-            print(('saving the latest model (epoch %d, total_steps %d)' % (epoch, iter_counter.total_steps_so_far)))
-            trainer.save('latest')
-            iter_counter.record_current_iter()
-        if jt.rank==0 and epoch>opt.pg_niter:
-            ct = 0
-            for (k, v) in losses.items():
-                if ct==1:
-                    GAN_Feat = v.mean().float()
-                if ct==2:
-                    VGG_loss = v.mean().float()
-                ct += 1
-            ep_acc_GAN_Feat_loss += GAN_Feat
-            ep_acc_VGG_loss += VGG_loss
-            ep_acc_GAN_Feat_perceptual += GAN_Feat + 5.0*VGG_loss
-        iter_ct+=1
-        jt.sync_all(True)
-    trainer.update_learning_rate(epoch)
-    iter_counter.record_epoch_end()
+        if jt.rank==0 and (epoch % opt.save_epoch_freq == 0 or \
+           epoch == iter_counter.total_epochs):
+            print('saving the model at the end of epoch %d, iters %d' %
+                  (epoch, iter_counter.total_steps_so_far))
+            with profiler.phase('save'):
+                progress = {'epoch': epoch + 1, 'epoch_iter': 0, 'sampler': sampler_state(dataloader)}
+                trainer.save(['latest', epoch], progress)
+        if jt.rank==0:
+            profiler.record_epoch_end()
 
-    if jt.rank==0 and (epoch % opt.save_epoch_freq == 0 or \
-       epoch == iter_counter.total_epochs):
-        print('saving the model at the end of epoch %d, iters %d' %
-              (epoch, iter_counter.total_steps_so_far))
-        trainer.save('latest')
-        trainer.save(epoch)
+        if fid_monitor is not None and fid_monitor.needs_evaluation(epoch):
+            stop_early = False
+            if jt.rank==0:
+                fid = fid_monitor.compute_fid(trainer.pix2pix_model, epoch)
+                writer.add_scalar('FID', fid, epoch)
+                stop_early = fid_monitor.update(trainer, epoch, fid)
+            if any_rank(stop_early):
+                if jt.rank==0:
+                    progress = {'epoch': epoch + 1, 'epoch_iter': 0, 'sampler': sampler_state(dataloader)}
+                    trainer.save('latest', progress)
+                break
 
-# print(opt.label_dir)    
-# shutil.rmtree(opt.label_dir) 
-print('Training was successfully finished.')
+    trainer.wait_for_saves()
+    if writer is not None:
+        writer.close()
+    # print(opt.label_dir)    
+    # shutil.rmtree(opt.label_dir) 
+    print('Training was successfully finished.')
+    return trainer, dataloader
 
+
+if __name__ == '__main__':
+    opt = TrainOptions().parse()
+    print(' '.join(sys.argv))
+    train(opt)
@@ -4,36 +4,191 @@ Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses
 """
 
 # from models.networks.sync_batchnorm import DataParallelWithCallback
+import os
 from models.pix2pix_model import Pix2PixModel
+import models.networks as networks
+import util.util as util
+from util.ema import ModelEMA
+from util import train_state
+from util.checkpoint_writer import AsyncCheckpointWriter
+from util.amp import DynamicLossScaler
+from util.distributed import broadcast_parameters, mean_over_ranks
 import jittor as jt
 
+
+# Splits a collated batch into |num_chunks| micro-batches along dim 0.
+# Returns a list of (micro-batch, its share of the whole batch).
+def split_batch(data, num_chunks):
+    batch_size = len(data['path'])
+    num_chunks = max(1, min(num_chunks, batch_size))
+    if num_chunks == 1:
+        return [(data, 1.0)]
+    bounds = [batch_size * i // num_chunks for i in range(num_chunks + 1)]
+    chunks = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        chunk = {}
+        for k, v in data.items():
+            chunk[k] = v[start:end] if isinstance(v, (jt.Var, list)) else v
+        chunks.append((chunk, (end - start) / batch_size))
+    return chunks
+
+
+# Weight of the loss |name| of a micro-batch with |share| of the batch.
+# Batch-mean losses are weighted by the share; the KLD loss is a sum over
+# the batch, the sums of the micro-batches add up to it as they are.
+def loss_weight(name, share):
+    return 1.0 if name == 'KLD' else share
+
+
+def concat_generated(generated):
+    if len(generated) == 1:
+        return generated[0]
+    if isinstance(generated[0], list):
+        return [jt.contrib.concat(list(g), dim=0) for g in zip(*generated)]
+    return jt.contrib.concat(generated, dim=0)
+
+
 class Pix2PixTrainer():
 
-    def __init__(self, opt):
+    # |warm_start|: trainer of the previous phase of train.py, whose networks
+    # (and EMAs) are the checkpoint opt.which_epoch, kept in memory
+    def __init__(self, opt, warm_start=None):
         self.opt = opt
-        self.pix2pix_model = Pix2PixModel(opt)
+        self.pix2pix_model = Pix2PixModel(opt, None if warm_start is None else warm_start.pix2pix_model)
+        # with MPI the replicas start from the weights of rank 0
+        model = self.pix2pix_model
+        broadcast_parameters([model.netG, model.netD, model.netE])
         self.generated = None
         if opt.isTrain:
             (self.optimizer_G, self.optimizer_D) = self.pix2pix_model.create_optimizers(opt)
             self.old_lr = opt.lr
+        self.emas = self.create_emas(opt, warm_start) if opt.isTrain and opt.ema_decay > 0 else {}
+        self.loss_scalers = {}
+        if opt.isTrain and opt.USE_AMP and not opt.no_loss_scaling:
+            print('mixed precision policy: %s' % self.pix2pix_model.precision.describe())
+            self.loss_scalers = {label: DynamicLossScaler(opt.loss_scale, growth_interval=opt.loss_scale_window)
+                                 for label in ('G', 'D')}
+        self.checkpoint_writer = AsyncCheckpointWriter() if opt.isTrain and opt.async_save else None
+        self.resume_progress = None
+        if opt.isTrain and opt.continue_train and not opt.no_train_state:
+            self.load_train_state(opt.which_epoch)
+
+    # EMA copies of the generator (and encoder), saved next to the regular
+    # checkpoints as '<epoch>_ema', e.g. test.py --which_epoch=300_ema
+    def create_emas(self, opt, warm_start=None):
+        model = self.pix2pix_model
+        emas = {'G': ModelEMA(model.netG, networks.define_G(opt), opt.ema_decay)}
+        if opt.use_vae:
+            emas['E'] = ModelEMA(model.netE, networks.define_E(opt), opt.ema_decay)
+        if opt.continue_train:
+            for label, ema in emas.items():
+                ema_epoch = '%s_ema' % opt.which_epoch
+                if warm_start is not None and label in warm_start.emas:
+                    ema.average.load_parameters(warm_start.emas[label].state_dict())
+                elif util.network_exists(label, ema_epoch, opt):
+                    util.load_network(ema.average, label, ema_epoch, opt)
+                else:
+                    print('no %s EMA checkpoint for epoch %s, starting the average from the loaded weights' % (label, opt.which_epoch))
+        return emas
 
+    def update_emas(self, epoch):
+        for ema in self.emas.values():
+            if epoch < self.opt.ema_start_epoch:
+                ema.copy()
+            else:
+                ema.update()
+
+    # With --accum_steps K the batch is split into K micro-batches whose
+    # gradients are accumulated before a single optimizer step. Every
+    # micro-batch loss is weighted by its share of the batch (see
+    # loss_weight), so the gradients match the unsplit batch. Each
+    # micro-batch is run to completion before the next one, see
+    # sync_micro_batch.
     def run_generator_one_step(self, data, epoch):
         self.optimizer_G.zero_grad()
-        (g_losses, generated) = self.pix2pix_model(data, epoch, mode='generator')
-        g_loss = sum(g_losses.values()).mean().float_auto()
-        self.optimizer_G.step(g_loss)
+        n_step = self.optimizer_G.n_step
+        g_losses = {}
+        generated = []
+        micro_batches = split_batch(data, self.opt.accum_steps)
+        for (micro_data, weight) in micro_batches:
+            (micro_losses, micro_generated) = self.pix2pix_model(micro_data, epoch, mode='generator')
+            # in float32: with --USE_AMP float_auto would cast to float16,
+            # where the loss scale overflows any loss above about 2
+            g_loss = sum(v.mean().float32() * loss_weight(k, weight) for k, v in micro_losses.items())
+            self.optimizer_G.backward(self.scale_loss(g_loss, 'G'))
+            for k, v in micro_losses.items():
+                g_losses[k] = g_losses.get(k, 0) + v.mean().detach() * loss_weight(k, weight)
+            if isinstance(micro_generated, list):
+                generated.append([g.detach() for g in micro_generated])
+            else:
+                generated.append(micro_generated.detach())
+            if len(micro_batches) > 1:
+                images = generated[-1] if isinstance(generated[-1], list) else [generated[-1]]
+                self.sync_micro_batch(self.optimizer_G, list(g_losses.values()) + images)
+        if self.optimizer_step(self.optimizer_G, 'G', n_step):
+            self.update_emas(epoch)
         self.g_losses = g_losses
-        self.generated = generated
+        self.generated = concat_generated(generated)
 
     def run_discriminator_one_step(self, data, epoch):
         self.optimizer_D.zero_grad()
-        d_losses = self.pix2pix_model(data, epoch, mode='discriminator')
-        d_loss = sum(d_losses.values()).mean().float_auto()
-        self.optimizer_D.step(d_loss)
+        n_step = self.optimizer_D.n_step
+        d_losses = {}
+        micro_batches = split_batch(data, self.opt.accum_steps)
+        for (micro_data, weight) in micro_batches:
+            micro_losses = self.pix2pix_model(micro_data, epoch, mode='discriminator')
+            d_loss = sum(micro_losses.values()).mean().float32() * weight
+            self.optimizer_D.backward(self.scale_loss(d_loss, 'D'))
+            for k, v in micro_losses.items():
+                d_losses[k] = d_losses.get(k, 0) + v.mean().detach() * weight
+            if len(micro_batches) > 1:
+                self.sync_micro_batch(self.optimizer_D, list(d_losses.values()))
+        self.optimizer_step(self.optimizer_D, 'D', n_step)
         self.d_losses = d_losses
 
+    # Executes the graph of the micro-batch just run. Optimizer.backward only
+    # chains the gradients lazily onto the accumulated ones, so without it the
+    # forward and backward graphs of all micro-batches would run together at
+    # optimizer.step() with the memory of the whole batch. Afterwards only the
+    # accumulated gradients and |values| (detached losses and images) are
+    # held, the activations of the micro-batch are freed.
+    def sync_micro_batch(self, optimizer, values):
+        grads = [g for pg in optimizer.param_groups for g in pg.get('grads', [])]
+        jt.sync(grads + values)
+        jt.gc()
+
+    def scale_loss(self, loss, label):
+        scaler = self.loss_scalers.get(label)
+        return loss if scaler is None else scaler.scale_loss(loss)
+
+    # Applies the gradients accumulated since the optimizer was at |n_step|.
+    # Jittor optimizers count backward calls, the Adam bias correction needs
+    # optimizer steps: the count is set back to one more step. With loss
+    # scaling a step whose gradients overflowed is skipped. Returns whether
+    # the weights were updated.
+    def optimizer_step(self, optimizer, label, n_step):
+        scaler = self.loss_scalers.get(label)
+        if scaler is not None:
+            finite = scaler.unscale(optimizer)
+            scaler.update(finite)
+            if not finite:
+                optimizer.n_step = n_step
+                optimizer.zero_grad()
+                return False
+        optimizer.n_step = n_step + 1
+        optimizer.step()
+        return True
+
+    # e.g. 'G: 2 of 1000 steps skipped, loss scale 16384', None without scaling
+    def loss_scale_report(self):
+        if len(self.loss_scalers) == 0:
+            return None
+        return ', '.join('%s: %d of %d steps skipped, loss scale %g' % (label, scaler.skipped, scaler.steps, scaler.scale)
+                         for label, scaler in self.loss_scalers.items())
+
+    # averaged over the ranks with MPI: a collective, call it on every rank
     def get_latest_losses(self):
-        return {**self.g_losses, **self.d_losses}
+        return {k: mean_over_ranks(v) for k, v in {**self.g_losses, **self.d_losses}.items()}
 
     def get_latest_generated(self):
         return self.generated
@@ -41,8 +196,67 @@ class Pix2PixTrainer():
     def update_learning_rate(self, epoch):
         self.update_learning_rate(epoch)
 
-    def save(self, epoch):
-        self.pix2pix_model.save(epoch)
+    # |epoch| is a name or a list of names saved from the same snapshot.
+    # |progress|: position of the training loop to resume from, a dict with
+    # 'epoch', 'epoch_iter' and the 'sampler' state at the start of that epoch.
+    # With it the optimizer, learning rate and RNG states are saved as well.
+    def save(self, epoch, progress=None):
+        epochs = epoch if isinstance(epoch, (list, tuple)) else [epoch]
+        self.pix2pix_model.save(epochs, self.checkpoint_writer)
+        for label, ema in self.emas.items():
+            util.save_network(ema.state_dict(), label, ['%s_ema' % ep for ep in epochs],
+                              self.opt, self.checkpoint_writer)
+        if progress is not None and not self.opt.no_train_state:
+            train_state.save_train_state(self.train_state(progress), epochs, self.opt,
+                                         self.checkpoint_writer)
+
+    # waits for the checkpoints written in the background (--async_save)
+    def wait_for_saves(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
+
+    def train_state(self, progress):
+        # drawn once per save point, 'latest' and the epoch share it
+        if 'rng' not in progress:
+            progress['rng'] = train_state.rng_state()
+        return {'progress': progress,
+                'pg_level': self.pg_level(progress['epoch']),
+                'optimizer_G': train_state.optimizer_state(self.optimizer_G),
+                'optimizer_D': train_state.optimizer_state(self.optimizer_D),
+                'loss_scalers': {label: scaler.state_dict() for label, scaler in self.loss_scalers.items()},
+                'old_lr': self.old_lr,
+                'lr': self.opt.lr}
+
+    def load_train_state(self, epoch):
+        state = train_state.load_train_state(epoch, self.opt)
+        if state is None:
+            print('no training state for epoch %s, optimizers start from scratch' % epoch)
+            return
+        if not (train_state.load_optimizer_state(self.optimizer_G, state['optimizer_G']) and
+                train_state.load_optimizer_state(self.optimizer_D, state['optimizer_D'])):
+            # e.g. the second phase of train.py adds layers, it starts a new run
+            print('the training state of epoch %s belongs to other networks, it is not restored' % epoch)
+            return
+        self.old_lr = state['old_lr']
+        self.opt.lr = state['lr']
+        for label, scaler_state in state.get('loss_scalers', {}).items():
+            if label in self.loss_scalers:
+                self.loss_scalers[label].load_state_dict(scaler_state)
+        train_state.set_rng_state(state['progress']['rng'])
+        self.resume_progress = state['progress']
+        print('restored the training state of epoch %s: resuming epoch %d at iteration %d, pg level %s' %
+              (epoch, state['progress']['epoch'], state['progress']['epoch_iter'], state['pg_level']))
+
+    def pg_level(self, epoch):
+        if self.opt.pg_strategy == 0 or self.opt.num_D <= 1 or epoch >= self.opt.pg_niter:
+            return 'full'
+        return epoch // (self.opt.pg_niter // (self.opt.num_D - 1))
+
+    def enable_forward_timing(self, timer):
+        self.pix2pix_model.enable_forward_timing(timer)
+
+    def disable_forward_timing(self, timer):
+        self.pix2pix_model.disable_forward_timing(timer)
 
     def update_learning_rate(self, epoch):
         if ((self.opt.pg_strategy != 0) and ((epoch % (self.opt.pg_niter // (self.opt.num_D - 1))) == 0) and (epoch < (self.opt.pg_niter + 1))):
@@ -0,0 +1,113 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+from contextlib import contextmanager
+import numpy as np
+import jittor as jt
+
+
+# Mixed precision per family of modules (--amp_policy), used with --USE_AMP.
+# Jittor picks the precision of an op when the op is created, from
+# jt.flags.auto_mixed_precision_level, so every family runs inside a scope
+# that sets the level, and the backward ops follow their forward ops:
+#   spade       SPADE generator and mask encoder
+#   D           multiscale discriminator
+#   perceptual  VGG / Inception network of the perceptual loss
+#   losses      loss arithmetic (GAN, feature matching, L1, KLD)
+# Code outside the families (preprocessing, augmentation, optimizers) keeps
+# the global level set by --USE_AMP.
+PRECISION_LEVELS = {'fp16': 5, 'fp32': 0}
+FAMILIES = ('spade', 'D', 'perceptual', 'losses')
+
+
+def parse_policy(policy):
+    levels = {}
+    for entry in policy.split(','):
+        if len(entry) == 0:
+            continue
+        family, _, precision = entry.partition('=')
+        if family not in FAMILIES:
+            raise ValueError('unknown module family %s in --amp_policy, expected one of %s' % (family, ', '.join(FAMILIES)))
+        if precision not in PRECISION_LEVELS:
+            raise ValueError('unknown precision %s in --amp_policy, expected fp16 or fp32' % precision)
+        levels[family] = PRECISION_LEVELS[precision]
+    return levels
+
+
+class PrecisionPolicy():
+    def __init__(self, opt):
+        self.enabled = opt.USE_AMP
+        self.levels = parse_policy(opt.amp_policy) if self.enabled else {}
+
+    # ops created inside run with the precision of |family|
+    @contextmanager
+    def scope(self, family):
+        if family not in self.levels:
+            yield
+            return
+        with jt.flag_scope(auto_mixed_precision_level=self.levels[family]):
+            yield
+
+    def describe(self):
+        names = dict((level, name) for name, level in PRECISION_LEVELS.items())
+        return ', '.join('%s=%s' % (family, names[self.levels[family]]) for family in FAMILIES
+                         if family in self.levels)
+
+
+# Dynamic loss scaling for one optimizer. The loss is multiplied by |scale|
+# before backward so that small float16 gradients do not flush to zero. The
+# gradients are checked once per step: with an inf or nan the step is
+# skipped and the scale halved, otherwise they are unscaled before the
+# update, and after |growth_interval| steps without overflow the scale
+# doubles.
+class DynamicLossScaler():
+    def __init__(self, init_scale=2.0**15, growth_factor=2.0, backoff_factor=0.5,
+                 growth_interval=2000, min_scale=1.0):
+        self.scale = init_scale
+        self.growth_factor = growth_factor
+        self.backoff_factor = backoff_factor
+        self.growth_interval = growth_interval
+        self.min_scale = min_scale
+        self.good_steps = 0
+        self.steps = 0
+        self.skipped = 0
+
+    # scaled in float32, a float16 loss would overflow
+    def scale_loss(self, loss):
+        return loss.float32() * self.scale
+
+    # Returns True if the gradients accumulated in |optimizer| are finite;
+    # they are unscaled then. Multiplying by zero keeps only infs and nans,
+    # a single sum and one sync check every gradient.
+    def unscale(self, optimizer):
+        grads = [g for pg in optimizer.param_groups
+                 for p, g in zip(pg['params'], pg.get('grads', [])) if not p.is_stop_grad()]
+        if len(grads) == 0:
+            return True
+        check = sum((g.float32() * 0).sum() for g in grads)
+        if not np.isfinite(check.item()):
+            return False
+        for g in grads:
+            g.update(g / self.scale)
+        return True
+
+    def update(self, finite):
+        self.steps += 1
+        if finite:
+            self.good_steps += 1
+            if self.good_steps % self.growth_interval == 0:
+                self.scale *= self.growth_factor
+        else:
+            self.skipped += 1
+            self.good_steps = 0
+            self.scale = max(self.scale * self.backoff_factor, self.min_scale)
+
+    def state_dict(self):
+        return {'scale': self.scale, 'good_steps': self.good_steps,
+                'steps': self.steps, 'skipped': self.skipped}
+
+    def load_state_dict(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
@@ -0,0 +1,102 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import numpy as np
+import jittor as jt
+from jittor import nn
+
+
+# Static per-layer cost analysis of the networks. Jittor evaluates lazily,
+# so running a forward pass only builds the graph and fixes the output
+# shapes of every layer; nothing is computed on the device as long as no
+# value is fetched. Forward hooks on the leaf layers read those shapes and
+# derive FLOPs, parameters and activation memory from them.
+# Only layers are counted: elementwise math written inline in execute()
+# (e.g. the SPADE modulation, functional leaky_relu / interpolate) is not.
+class LayerCostRecorder():
+    def __init__(self):
+        self.rows = []
+        self.attached = []
+
+    def attach(self, net, prefix):
+        for name, module in net.named_modules():
+            if len(module.modules()) != 1:  # only leaf layers
+                continue
+            full_name = prefix + '.' + name if len(name) > 0 else prefix
+
+            def hook(m, *args, full_name=full_name):
+                self.record(full_name, m, args[0], args[1])
+
+            module.register_forward_hook(hook)
+            self.attached.append(module)
+
+    def detach(self):
+        for module in self.attached:
+            if hasattr(module, '__fhook__'):
+                delattr(module, '__fhook__')
+        self.attached = []
+
+    def record(self, name, module, inputs, output):
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        if not isinstance(output, jt.Var):
+            return
+        params = sum(p.numel() for p in {id(p): p for p in module.parameters()}.values())
+        act_bytes = output.numel() * np.dtype(str(output.dtype)).itemsize
+        self.rows.append({'layer': name,
+                          'type': type(module).__name__,
+                          'output': 'x'.join(str(d) for d in output.shape),
+                          'params': params,
+                          'flops': layer_flops(module, inputs, output),
+                          'act_bytes': act_bytes})
+
+
+def layer_flops(module, inputs, output):
+    if isinstance(module, nn.ConvTranspose):
+        x = inputs[0]
+        cin, cout_per_group, kh, kw = module.weight.shape
+        return 2 * x.numel() * cout_per_group * kh * kw
+    if isinstance(module, nn.Conv):
+        cout, cin_per_group, kh, kw = module.weight.shape
+        return 2 * output.numel() * cin_per_group * kh * kw
+    if isinstance(module, nn.Linear):
+        return 2 * output.numel() * module.weight.shape[1]
+    if isinstance(module, (nn.InstanceNorm, nn.BatchNorm)):
+        # mean, variance, normalize (+ affine)
+        return 4 * output.numel()
+    # activations, upsampling, pooling: one op per output element
+    return output.numel()
+
+
+def summarize(rows):
+    summary = {}
+    for row in rows:
+        net = row['layer'].split('.')[0]
+        if net not in summary:
+            summary[net] = {'layers': 0, 'flops': 0, 'act_bytes': 0}
+        summary[net]['layers'] += 1
+        summary[net]['flops'] += row['flops']
+        summary[net]['act_bytes'] += row['act_bytes']
+    return summary
+
+
+def format_rows(rows):
+    message = '{:<56} {:<16} {:>20} {:>10} {:>10} {:>10}\n'.format(
+        'layer', 'type', 'output', 'params(K)', 'GFLOPs', 'act(MB)')
+    for row in rows:
+        message += '{:<56} {:<16} {:>20} {:>10.1f} {:>10.3f} {:>10.2f}\n'.format(
+            row['layer'], row['type'], row['output'], row['params'] / 1e3,
+            row['flops'] / 1e9, row['act_bytes'] / 2**20)
+    return message
+
+
+def write_csv(path, rows_by_level):
+    with open(path, 'w') as csv_file:
+        csv_file.write('level,layer,type,output,params,flops,act_bytes\n')
+        for level, rows in rows_by_level:
+            for row in rows:
+                csv_file.write('%s,%s,%s,%s,%d,%d,%d\n' % (
+                    level, row['layer'], row['type'], row['output'],
+                    row['params'], row['flops'], row['act_bytes']))
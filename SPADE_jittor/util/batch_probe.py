@@ -0,0 +1,103 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import time
+import jittor as jt
+from util.synthetic import synthetic_batch
+
+
+# bytes currently held by the jittor allocator (needs jt.flags.use_stat_allocator)
+def memory_in_use():
+    return jt.flags.stat_allocator_total_alloc_byte - jt.flags.stat_allocator_total_free_byte
+
+
+# the first step also compiles the kernels, leave it out when possible
+def mean_step_time(times):
+    if len(times) > 1:
+        times = times[1:]
+    return sum(times) / len(times)
+
+
+def release_memory():
+    try:
+        jt.sync_all(True)
+    except RuntimeError:
+        pass
+    jt.gc()
+
+
+# Runs |steps| generator and discriminator steps on a synthetic batch.
+# Returns (peak bytes seen after any step, seconds per step).
+def run_train_steps(trainer, opt, epoch, batch_size, steps):
+    peak = 0
+    times = []
+    for _ in range(steps):
+        data = synthetic_batch(opt, batch_size)
+        start = time.time()
+        trainer.run_generator_one_step(data, epoch)
+        jt.sync_all(True)
+        peak = max(peak, memory_in_use())
+        trainer.run_discriminator_one_step(data, epoch)
+        jt.sync_all(True)
+        peak = max(peak, memory_in_use())
+        times.append(time.time() - start)
+    return peak, mean_step_time(times)
+
+
+def run_inference_steps(model, opt, epoch, batch_size, steps):
+    peak = 0
+    times = []
+    with jt.no_grad():
+        for _ in range(steps):
+            data = synthetic_batch(opt, batch_size)
+            start = time.time()
+            input_semantics, real_image = model.preprocess_input(data)
+            fake_image, _ = model.generate_fake(input_semantics, real_image, epoch)
+            jt.sync_all(True)
+            peak = max(peak, memory_in_use())
+            times.append(time.time() - start)
+    return peak, mean_step_time(times)
+
+
+# Doubles the batch size until |run_steps| fails (out of memory or over
+# |budget| bytes) or |max_batch| is reached, then bisects between the last
+# success and the first failure. Returns the largest batch size that
+# succeeded with its peak memory and seconds per step, or None.
+def find_max_batch(run_steps, max_batch, budget):
+    def attempt(batch_size):
+        try:
+            peak, step_time = run_steps(batch_size)
+        except RuntimeError as e:
+            print('  batch %d: failed (%s)' % (batch_size, str(e).strip().split('\n')[0][:80]))
+            release_memory()
+            return None
+        release_memory()
+        if budget > 0 and peak > budget:
+            print('  batch %d: %.0f MB is over the budget' % (batch_size, peak / 2**20))
+            return None
+        print('  batch %d: %.0f MB, %.3f s/step, %.1f img/s' %
+              (batch_size, peak / 2**20, step_time, batch_size / step_time))
+        return peak, step_time
+
+    best = None
+    good, bad = 0, None
+    batch_size = 1
+    while batch_size <= max_batch:
+        result = attempt(batch_size)
+        if result is None:
+            bad = batch_size
+            break
+        good, best = batch_size, (batch_size,) + result
+        batch_size *= 2
+    if bad is None:
+        bad = max_batch + 1
+    while bad - good > 1:
+        batch_size = (good + bad) // 2
+        result = attempt(batch_size)
+        if result is None:
+            bad = batch_size
+        else:
+            good, best = batch_size, (batch_size,) + result
+    return best
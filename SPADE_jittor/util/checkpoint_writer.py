@@ -0,0 +1,118 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import os
+import atexit
+import pickle
+import threading
+from collections import OrderedDict
+import jittor as jt
+
+
+# copy of the weights of |net| in host memory, as numpy arrays
+def snapshot_network(net):
+    state = net.state_dict()
+    jt.sync(list(state.values()))
+    return {k: v.numpy() if isinstance(v, jt.Var) else v for k, v in state.items()}
+
+
+# Serializes |obj| once and writes it to every path in |paths|. Each file is
+# written to a temporary name, fsynced and renamed, so a crash never leaves
+# a truncated checkpoint behind: the previous file stays until the new one
+# is complete.
+def write_atomic(paths, obj):
+    data = pickle.dumps(obj, protocol=4)
+    for path in paths:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    directory = os.path.dirname(os.path.abspath(paths[0]))
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+# Writes checkpoints from a background thread (--async_save). The training
+# loop only pays for copying the weights to host memory (see
+# snapshot_network); pickling and disk I/O overlap with the next iterations.
+# At most one snapshot per file is pending: a newer snapshot for a file
+# replaces one that has not been written to it yet, even when the two were
+# submitted with different lists of files.
+class AsyncCheckpointWriter():
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.writing = None
+        self.error = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # |write|(paths, obj) runs in the background, write_atomic by default
+    def submit(self, paths, obj, write=write_atomic):
+        self.raise_error()
+        key = tuple(paths)
+        with self.condition:
+            # a pending snapshot must not overwrite a newer one later: strip
+            # every path it shares with |paths| and keep writing the others
+            pending = OrderedDict()
+            for stale_key, value in self.pending.items():
+                kept = tuple(path for path in stale_key if path not in key)
+                if len(kept) < len(stale_key):
+                    print('checkpoint %s is still pending, replacing it with the newer one' % stale_key[0])
+                if len(kept) > 0:
+                    pending[kept] = value
+            pending[key] = (obj, write)
+            self.pending = pending
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+                self.writing, (obj, write) = self.pending.popitem(last=False)
+            try:
+                write(list(self.writing), obj)
+            except Exception as e:
+                self.error = e
+            del obj
+            with self.condition:
+                self.writing = None
+                self.condition.notify_all()
+
+    # blocks until every submitted checkpoint is on disk
+    def flush(self):
+        with self.condition:
+            while len(self.pending) > 0 or self.writing is not None:
+                self.condition.wait()
+        self.raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('writing a checkpoint failed: %s' % error)
@@ -0,0 +1,63 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import jittor as jt
+
+
+# Data-parallel training over MPI, e.g. two CPU processes:
+#   mpirun -np 2 python train_phase.py --gpu_ids=-1 --batchSize=4 ...
+# Jittor shards and reduces by itself when it runs under MPI: every dataset
+# yields the share of the rank of each global batch (--batchSize is the
+# global batch size), and Optimizer.backward averages the gradients over the
+# ranks. The helpers below cover the rest: rank 0 writes the files, the
+# replicas start from the same weights, metrics are averaged over the ranks
+# and every rank leaves the training loop at the same iteration.
+
+def is_main_process():
+    return jt.rank == 0
+
+
+# returns once every rank got here, e.g. after rank 0 prepared files the
+# other ranks read
+def barrier():
+    if jt.in_mpi:
+        jt.array([1]).mpi_all_reduce('add').sync()
+
+
+def mean_over_ranks(value):
+    if not jt.in_mpi:
+        return value
+    return value.mpi_all_reduce('mean')
+
+
+# True on every rank if |flag| is True on any of them
+def any_rank(flag):
+    if not jt.in_mpi:
+        return flag
+    return jt.array([1 if flag else 0]).mpi_all_reduce('add').item() > 0
+
+
+# copies the weights and buffers of rank 0 to the other ranks
+def broadcast_parameters(nets):
+    if not jt.in_mpi:
+        return
+    for net in nets:
+        if net is None:
+            continue
+        for p in net.parameters():
+            p.assign(p.mpi_broadcast(0))
+        jt.sync(net.parameters())
+
+
+# Sum over ranks of how far the weights of |net| are from their average
+# over ranks, measured on one checksum per tensor. 0 while the replicas
+# stay in sync.
+def replica_divergence(net):
+    if not jt.in_mpi:
+        return 0.0
+    params = list({id(p): p for p in net.parameters()}.values())
+    checksums = jt.contrib.concat([p.float32().sum().reshape((1,)) for p in params], dim=0)
+    divergence = (checksums - checksums.mpi_all_reduce('mean')).abs().sum()
+    return divergence.mpi_all_reduce('add').item()
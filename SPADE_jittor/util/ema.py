@@ -0,0 +1,58 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import jittor as jt
+
+
+# Exponential moving average of the weights of |net|, kept on the device in
+# |average|, a second instance of the same architecture:
+#   w_avg = decay * w_avg + (1 - decay) * w
+# Only trainable weights are averaged. Everything else the network stores
+# (spectral norm u / v vectors, batch norm statistics) is copied as is.
+# This replaces averaging saved epochs afterwards with util/merge_ckpt.py.
+class ModelEMA():
+    def __init__(self, net, average, decay):
+        self.net = net
+        self.average = average
+        self.decay = decay
+        self.pairs = match_parameters(net, average)
+        self.copy()
+
+    # w_avg = w, used until the averaging starts
+    def copy(self):
+        for param, avg, _ in self.pairs:
+            avg.update(param.detach())
+        jt.sync([avg for _, avg, _ in self.pairs])
+
+    def update(self):
+        for param, avg, trainable in self.pairs:
+            if trainable:
+                avg.update((avg * self.decay + param.detach() * (1 - self.decay)).detach())
+            else:
+                avg.update(param.detach())
+        jt.sync([avg for _, avg, _ in self.pairs])
+
+    # Weights of the average as numpy arrays, restricted to the names |net|
+    # still has (the generator drops its intermediate progressive growing
+    # heads once it reaches the full resolution).
+    def state_dict(self):
+        names = set(name for name, _ in self.net.named_parameters())
+        return {name: avg.numpy() for name, avg in self.average.named_parameters()
+                if name in names}
+
+
+# (net weight, average weight, is trainable) for every weight of |net|.
+# Spectral norm registers the same weight twice (weight and weight_orig),
+# each weight is paired only once.
+def match_parameters(net, average):
+    averages = dict(average.named_parameters())
+    pairs = []
+    seen = set()
+    for name, param in net.named_parameters():
+        if id(param) in seen or name not in averages:
+            continue
+        seen.add(id(param))
+        pairs.append((param, averages[name], not param.is_stop_grad()))
+    return pairs
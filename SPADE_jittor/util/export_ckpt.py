@@ -0,0 +1,90 @@
+import os
+import sys
+import re
+import pickle
+import argparse
+import numpy as np
+if not __package__:  # run as python util/export_ckpt.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.tensor_file import TensorFile, write_tensor_file, to_bfloat16, EXTENSION
+
+
+# Writes an inference-only copy of the generator (and the mask encoder it
+# uses at test time) in half precision, e.g.
+#   python util/export_ckpt.py ./checkpoints/label2img 300_ema --dtype fp16
+#   python test.py --which_epoch=300_ema_fp16
+# Dropped: the intermediate progressive growing heads (inter_conv_img) and
+# the spectral norm state. The spectral norm hook of this port does not
+# change the weight used in the forward pass (weight is weight_orig), so the
+# folded weight is |weight| and weight_orig / weight_u / weight_v can go.
+# Both names refer to the same Var and state_dict() keeps only the first one
+# it meets, which is usually weight_orig: it is renamed to weight then.
+# Normalization statistics stay in float32.
+TRAINING_ONLY = re.compile(r'^inter_conv_img\.')
+SPECTRAL_NORM_STATE = re.compile(r'\.weight_(orig|u|v)$')
+FLOAT32_KEYS = re.compile(r'(running_mean|running_var)$')
+
+
+def load_weights(path):
+    if path.endswith(EXTENSION):
+        return TensorFile(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def export_weights(weights, dtype):
+    exported = {}
+    bfloat16 = []
+    for key in weights.keys():
+        value = weights[key]
+        if TRAINING_ONLY.search(key):
+            continue
+        if key.endswith('.weight_orig') and key[:-len('_orig')] not in weights:
+            key = key[:-len('_orig')]
+        elif SPECTRAL_NORM_STATE.search(key):
+            continue
+        value = np.asarray(value)
+        if not np.issubdtype(value.dtype, np.floating) or FLOAT32_KEYS.search(key):
+            exported[key] = value
+        elif dtype == 'bf16':
+            exported[key] = to_bfloat16(value)
+            bfloat16.append(key)
+        else:
+            exported[key] = value.astype(np.float16)
+    return exported, bfloat16
+
+
+def checkpoint_path(path, epoch, label):
+    tensor_path = os.path.join(path, '%s_net_%s%s' % (epoch, label, EXTENSION))
+    if os.path.exists(tensor_path):
+        return tensor_path
+    return os.path.join(path, '%s_net_%s.pkl' % (epoch, label))
+
+
+def export_ckpt(path, epoch, nets=('G', 'E'), dtype='fp16', name=None):
+    if name is None:
+        name = '%s_%s' % (epoch, dtype)
+    for label in nets:
+        src = checkpoint_path(path, epoch, label)
+        if not os.path.exists(src):
+            print('skipping %s, %s does not exist' % (label, src))
+            continue
+        weights = load_weights(src)
+        exported, bfloat16 = export_weights(weights, dtype)
+        dst = os.path.join(path, '%s_net_%s%s' % (name, label, EXTENSION))
+        write_tensor_file(dst, exported, {'export_dtype': dtype, 'source': os.path.basename(src)}, bfloat16)
+        print('%s -> %s: %d of %d tensors, %.1f MB -> %.1f MB' % (
+            src, dst, len(exported), len(weights), os.path.getsize(src) / 2**20, os.path.getsize(dst) / 2**20))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='export a half precision, inference-only generator checkpoint')
+    parser.add_argument('path', help='checkpoint directory, e.g. ./checkpoints/label2img')
+    parser.add_argument('epoch', help='epoch to export, e.g. 300, 300_ema or avg_273_299')
+    parser.add_argument('--dtype', type=str, default='fp16', help='fp16 | bf16')
+    parser.add_argument('--nets', type=str, default='G,E', help='comma separated labels of the nets used at test time')
+    parser.add_argument('--name', type=str, default=None, help='output epoch name, default <epoch>_<dtype>')
+    args = parser.parse_args()
+    if args.dtype not in ('fp16', 'bf16'):
+        raise ValueError('--dtype must be fp16 or bf16')
+    export_ckpt(args.path, args.epoch, [net for net in args.nets.split(',') if len(net) > 0], args.dtype, args.name)
@@ -18,7 +18,6 @@ import shutil
 FID_WEIGHTS_URL = 'https://github.com/mseitzer/pytorch-fid/releases/download/fid_weights/pt_inception-2015-12-05-6726825d.pth'
 
 os.environ['CUDA_LAUNCH_BLOCKING'] = '1'
-jt.flags.use_cuda = 1
 
 class InceptionV3(nn.Module):
     DEFAULT_BLOCK_INDEX = 3
@@ -190,6 +189,18 @@ def get_activations(files, model, batch_size=50, dims=2048,verbose=False):
     print(pred_arr.shape)
     return pred_arr
 
+# |images|: uint8 arrays (h, w, 3), e.g. generator outputs, scaled like the
+# image files read by get_activations
+def get_image_activations(images, model):
+    model.eval()
+    images = np.array([resize(img.astype(np.float32), (256, 256, 3)) for img in images])
+    images = images.transpose((0, 3, 1, 2))
+    images /= 255
+    pred = model(jt.Var(images))[0]
+    if ((pred.shape[2] != 1) or (pred.shape[3] != 1)):
+        pred = nn.AdaptiveAvgPool2d(output_size=(1, 1))(pred)
+    return pred.numpy().reshape(len(images), -1)
+
 def calculate_frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-06):
     mu1 = np.atleast_1d(mu1)
     mu2 = np.atleast_1d(mu2)
@@ -227,16 +238,8 @@ def _compute_statistics_of_path(path, model, batch_size, dims):
         (m, s) = calculate_activation_statistics(files, model, batch_size, dims)
     return (m, s)
 
-def calculate_fid_given_paths(train_path, test_path, stat_path, batch_size, dims):
-    if not os.path.exists(test_path):
-        raise RuntimeError(('Invalid path: %s' % test_path))
-    if not os.path.exists(train_path):
-        raise RuntimeError(('Invalid path: %s' % train_path))
-    if not os.path.exists(stat_path):
-        raise RuntimeError(('Invalid path: %s' % stat_path))
-    block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[dims]
-    model = InceptionV3([block_idx])
-
+# statistics of the training images, cached in |stat_path|
+def reference_statistics(train_path, stat_path, model, batch_size, dims):
     train_m_path = os.path.join(stat_path,'train_fid_m.npy')
     train_s_path = os.path.join(stat_path,'train_fid_s.npy')
     if os.path.exists(train_m_path) and os.path.exists(train_s_path):
@@ -246,7 +249,19 @@ def calculate_fid_given_paths(train_path, test_path, stat_path, batch_size, dims
         (m1,s1) = _compute_statistics_of_path(train_path, model, batch_size, dims)
         np.save(train_m_path,m1)
         np.save(train_s_path,s1)
+    return (m1, s1)
+
+def calculate_fid_given_paths(train_path, test_path, stat_path, batch_size, dims):
+    if not os.path.exists(test_path):
+        raise RuntimeError(('Invalid path: %s' % test_path))
+    if not os.path.exists(train_path):
+        raise RuntimeError(('Invalid path: %s' % train_path))
+    if not os.path.exists(stat_path):
+        raise RuntimeError(('Invalid path: %s' % stat_path))
+    block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[dims]
+    model = InceptionV3([block_idx])
 
+    (m1, s1) = reference_statistics(train_path, stat_path, model, batch_size, dims)
     (m2, s2) = _compute_statistics_of_path(test_path, model, batch_size, dims)
     fid_value = calculate_frechet_distance(m1, s1, m2, s2)
     return fid_value
@@ -258,30 +273,34 @@ def get_offline_fid(train_path, test_path, stat_path='checkpoints/label2img'):
     # print(test_path, 'fid_value: ', fid_value)
     return fid_value
 
-train_path = sys.argv[1]
-test_path = sys.argv[2]
-ckpts_path = sys.argv[3]
-ckpts_to_test_fid = []
-for i in range(4, len(sys.argv)):
-    ckpt = str(sys.argv[i])
-    print(ckpt.split('-'))
-    if len(ckpt.split('-'))>1:
-        ckpts = list(range(eval(ckpt.split('-')[0]),eval(ckpt.split('-')[1])+1))
-        ckpts = [str(x) for x in ckpts]
-        ckpts_to_test_fid = ckpts_to_test_fid+ckpts
-        continue
-    ckpts_to_test_fid.append(ckpt)
-checkpoints_dir,name = os.path.split(ckpts_path)
+# the networks and statistics above are also used during training, see
+# util/fid_monitor.py
+if __name__ == '__main__':
+    jt.flags.use_cuda = 1
+    train_path = sys.argv[1]
+    test_path = sys.argv[2]
+    ckpts_path = sys.argv[3]
+    ckpts_to_test_fid = []
+    for i in range(4, len(sys.argv)):
+        ckpt = str(sys.argv[i])
+        print(ckpt.split('-'))
+        if len(ckpt.split('-'))>1:
+            ckpts = list(range(eval(ckpt.split('-')[0]),eval(ckpt.split('-')[1])+1))
+            ckpts = [str(x) for x in ckpts]
+            ckpts_to_test_fid = ckpts_to_test_fid+ckpts
+            continue
+        ckpts_to_test_fid.append(ckpt)
+    checkpoints_dir,name = os.path.split(ckpts_path)
 
-if not os.path.exists('./temp'):
-    os.makedirs('./temp')
+    if not os.path.exists('./temp'):
+        os.makedirs('./temp')
 
-for ep in ckpts_to_test_fid:
-    which_epoch = os.path.join(ckpts_path,ep)
-    if not os.path.exists(which_epoch+'_net_G.pkl'):
-        continue
-    print(("python test.py --input_path=%s --checkpoints_dir=%s --name=%s --out_path='./temp' --which_epoch=%s" % (test_path,checkpoints_dir,name,ep)))
-    os.system("python test.py --input_path=%s --checkpoints_dir=%s --name=%s --out_path='./temp' --which_epoch=%s" % (test_path,checkpoints_dir,name,ep))
-    fid = get_offline_fid(train_path, './temp')
-    print(which_epoch,' fid: ', fid)
-shutil.rmtree('./temp') 
+    for ep in ckpts_to_test_fid:
+        which_epoch = os.path.join(ckpts_path,ep)
+        if not os.path.exists(which_epoch+'_net_G.pkl') and not os.path.exists(which_epoch+'_net_G.tensors'):
+            continue
+        print(("python test.py --input_path=%s --checkpoints_dir=%s --name=%s --out_path='./temp' --which_epoch=%s" % (test_path,checkpoints_dir,name,ep)))
+        os.system("python test.py --input_path=%s --checkpoints_dir=%s --name=%s --out_path='./temp' --which_epoch=%s" % (test_path,checkpoints_dir,name,ep))
+        fid = get_offline_fid(train_path, './temp')
+        print(which_epoch,' fid: ', fid)
+    shutil.rmtree('./temp') 
@@ -0,0 +1,144 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import os
+import json
+import random
+import numpy as np
+import jittor as jt
+import data
+from util import train_state
+from util.util import remove_network
+from util.batch_probe import release_memory
+from util.fid import InceptionV3, reference_statistics, get_image_activations, calculate_frechet_distance
+
+
+# Removes |num_images| items, picked with a fixed seed, from the training
+# set of |dataloader| and returns them as a dataset of their own. The same
+# file list always gives the same split, on every MPI rank; a dataloader
+# reused by the next phase of train.py keeps its split.
+def hold_out(dataloader, num_images):
+    if hasattr(dataloader, 'held_out'):
+        return dataloader.held_out
+    size = len(dataloader.label_paths)
+    assert num_images < size, '--fid_num_images %d leaves no training images out of %d' % (num_images, size)
+    picked = set(np.random.RandomState(0).choice(size, num_images, replace=False).tolist())
+
+    held_out = type(dataloader)()
+    held_out.opt = dataloader.opt
+    for paths in ('label_paths', 'image_paths', 'instance_paths'):
+        items = getattr(dataloader, paths)
+        if len(items) == 0:
+            setattr(held_out, paths, [])
+            continue
+        setattr(held_out, paths, [p for i, p in enumerate(items) if i in picked])
+        setattr(dataloader, paths, [p for i, p in enumerate(items) if i not in picked])
+    held_out.dataset_size = len(held_out.label_paths)
+    dataloader.dataset_size = len(dataloader.label_paths)
+    dataloader.set_attrs(total_len=dataloader.dataset_size)
+    dataloader.held_out = held_out
+    print('%d images are held out of training for FID, %d left' % (held_out.dataset_size, dataloader.dataset_size))
+    return held_out
+
+
+# FID of the live generator every --fid_freq epochs, on images generated from
+# the label maps of a fixed held-out subset of the training set, against the
+# statistics of the training images (cached as train_fid_m/s.npy in the
+# checkpoint directory, like util/fid.py). With --fid_best_k the checkpoints
+# of the K best evaluations are kept as '<epoch>_fid', e.g.
+# test.py --which_epoch=265_fid; with --fid_patience training stops after
+# that many evaluations without a new best. The scores are logged to
+# fid_log.json, which a continued run reads back.
+class FIDMonitor():
+    def __init__(self, opt, dataloader):
+        self.opt = opt
+        self.held_out = hold_out(dataloader, opt.fid_num_images)
+        self.batch_size = opt.fid_batchSize if opt.fid_batchSize > 0 else opt.batchSize
+        self.log_path = os.path.join(opt.checkpoints_dir, opt.name, 'fid_log.json')
+        # (epoch, fid) of every evaluation, and of the kept checkpoints, best first
+        self.history = []
+        self.best = []
+        if opt.continue_train and os.path.exists(self.log_path):
+            with open(self.log_path) as log_file:
+                log = json.load(log_file)
+            self.history = [tuple(entry) for entry in log['history']]
+            self.best = [tuple(entry) for entry in log['best']]
+        self.inception = None
+        self.reference = None
+
+    # The generator only outputs full resolution images after the
+    # progressive growing epochs
+    def needs_evaluation(self, epoch):
+        full_resolution = self.opt.pg_strategy == 0 or epoch >= self.opt.pg_niter
+        return full_resolution and epoch % self.opt.fid_freq == 0
+
+    def compute_fid(self, model, epoch):
+        if self.inception is None:
+            self.inception = InceptionV3([InceptionV3.BLOCK_INDEX_BY_DIM[2048]])
+            with jt.flag_scope(auto_mixed_precision_level=0):
+                self.reference = reference_statistics(self.opt.image_dir, os.path.join(self.opt.checkpoints_dir, self.opt.name),
+                                                      self.inception, 10, 2048)
+        # the same crops, flips and noise at every evaluation, and the
+        # training run continues with its own random state
+        rng = train_state.rng_state()
+        random.seed(0)
+        np.random.seed(0)
+        jt.set_seed(0)
+        model.eval()
+        activations = []
+        with jt.no_grad():
+            for start in range(0, len(self.held_out), self.batch_size):
+                items = [self.held_out[i] for i in range(start, min(start + self.batch_size, len(self.held_out)))]
+                data_i, num_images = data.pad_batch(self.held_out.to_jittor(self.held_out.collate_batch(items)), self.batch_size)
+                input_semantics, real_image = model.preprocess_input(data_i)
+                fake_image, _ = model.generate_fake(input_semantics, real_image, epoch)
+                # quantized like the images test.py writes
+                images = (np.transpose(fake_image[:num_images].float32().numpy(), (0, 2, 3, 1)) + 1) / 2.0 * 255.0
+                with jt.flag_scope(auto_mixed_precision_level=0):
+                    activations.append(get_image_activations(images.astype(np.uint8), self.inception))
+        model.train()
+        train_state.set_rng_state(rng)
+        release_memory()
+        activations = np.concatenate(activations, axis=0)
+        mu, sigma = self.reference
+        return float(calculate_frechet_distance(mu, sigma, np.mean(activations, axis=0), np.cov(activations, rowvar=False)))
+
+    def checkpoint_name(self, epoch):
+        return '%d_fid' % epoch
+
+    def remove_checkpoint(self, epoch):
+        name = self.checkpoint_name(epoch)
+        for label in ('G', 'D', 'E'):
+            remove_network(label, name, self.opt)
+            remove_network(label, '%s_ema' % name, self.opt)
+
+    # Records the FID of |epoch| and keeps its checkpoint if it is among the
+    # best --fid_best_k. A continued run forgets the evaluations it repeats.
+    # Returns True when training should stop.
+    def update(self, trainer, epoch, fid):
+        self.history = [entry for entry in self.history if entry[0] < epoch] + [(epoch, fid)]
+        if self.opt.fid_best_k > 0:
+            dropped = [entry for entry in self.best if entry[0] >= epoch]
+            self.best = sorted([entry for entry in self.best if entry[0] < epoch] + [(epoch, fid)], key=lambda entry: entry[1])
+            dropped += self.best[self.opt.fid_best_k:]
+            self.best = self.best[:self.opt.fid_best_k]
+            if (epoch, fid) in self.best:
+                trainer.save(self.checkpoint_name(epoch))
+            trainer.wait_for_saves()
+            kept = [entry[0] for entry in self.best]
+            for dropped_epoch, _ in dropped:
+                if dropped_epoch not in kept:
+                    self.remove_checkpoint(dropped_epoch)
+        with open(self.log_path, 'w') as log_file:
+            json.dump({'history': self.history, 'best': self.best}, log_file, indent=1)
+
+        best_epoch, best_fid = min(self.history, key=lambda entry: entry[1])
+        print('FID of epoch %d on %d held-out images: %.3f (best %.3f at epoch %d)' %
+              (epoch, len(self.held_out), fid, best_fid, best_epoch))
+        evaluations_since_best = len([entry for entry in self.history if entry[0] > best_epoch])
+        if self.opt.fid_patience > 0 and evaluations_since_best >= self.opt.fid_patience:
+            print('FID did not improve for %d evaluations, stopping early' % evaluations_since_best)
+            return True
+        return False
@@ -29,13 +29,18 @@ class IterationCounter():
 
         self.total_steps_so_far = (self.first_epoch - 1) * dataset_size + self.epoch_iter
 
+    # resume from a saved training state instead of iter.txt
+    def resume(self, first_epoch, epoch_iter):
+        self.first_epoch, self.epoch_iter = first_epoch, epoch_iter
+        self.total_steps_so_far = (self.first_epoch - 1) * self.dataset_size + self.epoch_iter
+
     # return the iterator of epochs for the training
     def training_epochs(self):
         return range(self.first_epoch, self.total_epochs + 1)
 
-    def record_epoch_start(self, epoch):
+    def record_epoch_start(self, epoch, epoch_iter=0):
         self.epoch_start_time = time.time()
-        self.epoch_iter = 0
+        self.epoch_iter = epoch_iter
         self.last_iter_time = time.time()
         self.current_epoch = epoch
 
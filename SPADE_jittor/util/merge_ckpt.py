@@ -1,37 +1,142 @@
 import pickle
 import os
-import numpy as np
 import sys
+import re
+import glob
+import fnmatch
+import argparse
+import numpy as np
+if not __package__:  # run as python util/merge_ckpt.py
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.tensor_file import TensorFile, write_tensor_file, EXTENSION
+
+
+# Averages the weights of several saved epochs in one pass. Checkpoints are
+# read one at a time and added to a single running sum per net, so memory
+# stays at about two copies of a net whatever the number of epochs
+# (.tensors checkpoints are memory-mapped and read one weight at a time).
+# Epochs can be given as explicit epochs (265), inclusive ranges (273-299,
+# missing epochs are skipped) or globs matched against the saved files (2?5).
+# The result is saved as avg_<epochs>_net_<label>.pkl, e.g.
+#   python util/merge_ckpt.py ./checkpoints/label2img 265 280
+#   python test.py --which_epoch=avg_265_280
+
+
+def available_epochs(path, label):
+    pattern = re.compile(r'^(.+)_net_%s(\.pkl|%s)$' % (re.escape(label), re.escape(EXTENSION)))
+    epochs = []
+    for filename in os.listdir(path):
+        match = pattern.match(filename)
+        if match and match.group(1) not in epochs:
+            epochs.append(match.group(1))
+    return epochs
+
+
+# a dict-like of numpy arrays, the .tensors file when there is one
+def load_weights(path, ep, label):
+    tensor_path = os.path.join(path, '%s_net_%s%s' % (ep, label, EXTENSION))
+    if os.path.exists(tensor_path):
+        print(tensor_path)
+        return TensorFile(tensor_path)
+    model_path = os.path.join(path, '%s_net_%s.pkl' % (ep, label))
+    print(model_path)
+    with open(model_path, 'rb') as f:
+        return pickle.load(f)
 
 
-def merge_ckpt(path,ckpts_to_merge):
-    ckpt_root_path = path
-    save_path = os.path.join(path, 'avg_' + '_'.join(ckpts_to_merge) + '_net')
-    model_nets = ['E','G'] # 'E' or 'G'
+def epoch_sort_key(epoch):
+    return (0, int(epoch), epoch) if epoch.isdigit() else (1, 0, epoch)
 
+
+# expands ranges and globs into the epochs saved for |label|, in order
+def resolve_epochs(path, specs, label):
+    available = available_epochs(path, label)
+    epochs = []
+    for spec in specs:
+        if re.match(r'^\d+-\d+$', spec):
+            start, end = [int(x) for x in spec.split('-')]
+            found = [str(ep) for ep in range(start, end + 1) if str(ep) in available]
+        elif glob.has_magic(spec):
+            found = sorted(fnmatch.filter(available, spec), key=epoch_sort_key)
+        else:
+            found = [spec] if spec in available else []
+        if len(found) == 0:
+            print('no %s checkpoint matches %s' % (label, spec))
+        epochs += [ep for ep in found if ep not in epochs]
+    return epochs
+
+
+# uniform: every epoch counts the same.
+# exp: epoch i of n gets decay ** (n - 1 - i), the last one weighs most.
+def averaging_weights(num, weighting, decay):
+    if weighting == 'uniform':
+        weights = np.ones(num)
+    elif weighting == 'exp':
+        weights = decay ** np.arange(num - 1, -1, -1, dtype=np.float64)
+    else:
+        raise ValueError('unknown weighting %s' % weighting)
+    return weights / weights.sum()
+
+
+def merge_net(path, label, epochs, weights):
+    running_sum = None
+    for ep, weight in zip(epochs, weights.tolist()):
+        print('epoch %s, weight %.4f' % (ep, weight))
+        model_weight = load_weights(path, ep, label)
+        if running_sum is None:
+            running_sum = {}
+            dtypes = {}
+            for key, value in model_weight.items():
+                value = np.asarray(value)
+                dtypes[key] = value.dtype
+                if np.issubdtype(value.dtype, np.floating):
+                    running_sum[key] = value.astype(np.promote_types(value.dtype, np.float32)) * weight
+                else:
+                    running_sum[key] = value
+        else:
+            if set(model_weight.keys()) != set(running_sum.keys()):
+                raise ValueError('epoch %s does not have the same weights as %s' % (ep, epochs[0]))
+            for key, value in model_weight.items():
+                value = np.asarray(value)
+                if np.issubdtype(value.dtype, np.floating):
+                    running_sum[key] += value * weight
+                else:
+                    # integer buffers cannot be averaged, keep the latest
+                    running_sum[key] = value
+        del model_weight
+    return {key: value.astype(dtypes[key]) for key, value in running_sum.items()}
+
+
+def merge_ckpt(path, ckpts_to_merge, nets=('E', 'G'), weighting='uniform', decay=0.9, name=None, out_format='pkl'):
+    if name is None:
+        name = 'avg_' + '_'.join(ckpts_to_merge)
+    save_path = os.path.join(path, name + '_net')
     print(save_path)
 
-    for model in model_nets:
-        model_weights = []
-        for ep in ckpts_to_merge:
-            net_name = '%s_net_%s.pkl'%(ep,model)
-            model_path = os.path.join(ckpt_root_path,net_name)
-            print(model_path)
-            model_weights.append(pickle.load(open(model_path,'rb+')))
-        
-        weight_avg = {}
-        for key in model_weights[0].keys():
-            ws = np.zeros(model_weights[0][key].shape)
-            for model_weight in model_weights:
-                ws+=model_weight[key]
-            weight_avg[key] = ws/len(model_weights)
-
-        with open('%s_%s.pkl'%(save_path, model),'wb') as fo:
-            pickle.dump(weight_avg,fo)
+    for label in nets:
+        epochs = resolve_epochs(path, ckpts_to_merge, label)
+        if len(epochs) == 0:
+            print('skipping %s' % label)
+            continue
+        weights = averaging_weights(len(epochs), weighting, decay)
+        averaged = merge_net(path, label, epochs, weights)
+        if out_format == 'tensors':
+            write_tensor_file('%s_%s%s' % (save_path, label, EXTENSION), averaged)
+        else:
+            with open('%s_%s.pkl' % (save_path, label), 'wb') as fo:
+                pickle.dump(averaged, fo)
+        print('averaged %d %s checkpoints: %s' % (len(epochs), label, ' '.join(epochs)))
+
 
 if __name__ == "__main__":
-    path = sys.argv[1]
-    ckpts_to_merge = []
-    for i in range(2, len(sys.argv)):
-        ckpts_to_merge.append(str(sys.argv[i]))
-    merge_ckpt(path,ckpts_to_merge)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='average the weights of saved epochs')
+    parser.add_argument('path', help='checkpoint directory, e.g. ./checkpoints/label2img')
+    parser.add_argument('epochs', nargs='+', help='epochs (265), inclusive ranges (273-299) or globs (2?5)')
+    parser.add_argument('--nets', type=str, default='E,G', help='comma separated labels of the nets to average, e.g. G,E,D')
+    parser.add_argument('--weighting', type=str, default='uniform', help='uniform | exp')
+    parser.add_argument('--decay', type=float, default=0.9, help='decay per epoch of the exp weighting, the last epoch weighs most')
+    parser.add_argument('--name', type=str, default=None, help='output epoch name, default avg_<epochs>')
+    parser.add_argument('--format', type=str, default='pkl', help='output format: pkl | tensors')
+    args = parser.parse_args()
+    nets = [net for net in args.nets.split(',') if len(net) > 0]
+    merge_ckpt(args.path, args.epochs, nets, args.weighting, args.decay, args.name, args.format)
@@ -0,0 +1,158 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import os
+import json
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import numpy as np
+import jittor as jt
+
+
+# Helper class that measures how long each phase of a training iteration
+# takes (data loading, generator step, discriminator step, logging, saving).
+# Jittor runs device work asynchronously, so every phase boundary is
+# synchronized before the clock is read. This only happens with --profile;
+# otherwise all methods are cheap no-ops and no extra syncs are issued.
+class StepProfiler():
+    def __init__(self, opt):
+        self.opt = opt
+        self.enabled = opt.isTrain and opt.profile
+        self.window = opt.profile_window
+        self.rolling = OrderedDict()
+        self.epoch_times = OrderedDict()
+        self.last_mark = time.time()
+        self.summary_path = os.path.join(opt.checkpoints_dir, opt.name, 'profile.txt')
+
+    def record_epoch_start(self, epoch):
+        self.current_epoch = epoch
+        self.epoch_times = OrderedDict()
+        self.last_mark = time.time()
+
+    # time spent waiting for the dataloader since the previous iteration ended
+    def record_data(self):
+        if not self.enabled:
+            return
+        self.record('data', time.time() - self.last_mark)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        jt.sync_all(True)
+        start = time.time()
+        try:
+            yield
+        finally:
+            jt.sync_all(True)
+            self.record(name, time.time() - start)
+
+    def record_iteration_end(self):
+        if not self.enabled:
+            return
+        jt.sync_all(True)
+        self.last_mark = time.time()
+
+    def record(self, name, seconds):
+        if name not in self.rolling:
+            self.rolling[name] = deque(maxlen=self.window)
+            self.epoch_times[name] = []
+        elif name not in self.epoch_times:
+            self.epoch_times[name] = []
+        self.rolling[name].append(seconds)
+        self.epoch_times[name].append(seconds)
+
+    # rolling p50/p90 of every phase over the last |profile_window| iterations
+    def current_percentiles(self):
+        message = '(profile, ms) '
+        for name, times in self.rolling.items():
+            if len(times) == 0:
+                continue
+            p50, p90 = np.percentile(np.array(times) * 1000, [50, 90])
+            message += '%s: %.1f/%.1f ' % (name, p50, p90)
+        return message
+
+    def print_current_percentiles(self):
+        if not self.enabled:
+            return
+        print(self.current_percentiles())
+
+    def record_epoch_end(self):
+        if not self.enabled or len(self.epoch_times) == 0:
+            return
+        total = sum(sum(times) for times in self.epoch_times.values())
+        message = '================ Profile of epoch %d (%s) ================\n' % \
+            (self.current_epoch, time.strftime("%c"))
+        message += '{:>10} {:>7} {:>10} {:>9} {:>9} {:>9} {:>9} {:>7}\n'.format(
+            'phase', 'count', 'total(s)', 'mean(ms)', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'share')
+        for name, times in self.epoch_times.items():
+            times_ms = np.array(times) * 1000
+            p50, p90, p99 = np.percentile(times_ms, [50, 90, 99])
+            message += '{:>10} {:>7d} {:>10.2f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>6.1f}%\n'.format(
+                name, len(times), times_ms.sum() / 1000, times_ms.mean(), p50, p90, p99,
+                100.0 * times_ms.sum() / 1000 / max(total, 1e-12))
+        print(message)
+        with open(self.summary_path, 'a') as summary_file:
+            summary_file.write(message)
+
+
+# Records the wall time of every forward call of the submodules it is
+# attached to (see models.networks.base_network.attach_forward_timer).
+# Nested calls are tracked on a stack so that both the inclusive time and
+# the self time (excluding timed children) of each module are known.
+# Every start/stop synchronizes the device, so only attach it for a few
+# iterations.
+class ForwardTimer():
+    def __init__(self):
+        self.events = []
+        self.stack = []
+        self.attached = []
+        self.origin = time.time()
+
+    def start(self, name):
+        jt.sync_all(True)
+        self.stack.append([name, time.time(), 0.0])
+
+    def stop(self, name):
+        jt.sync_all(True)
+        end = time.time()
+        name, start, child_time = self.stack.pop()
+        duration = end - start
+        if len(self.stack) > 0:
+            self.stack[-1][2] += duration
+        self.events.append((name, start - self.origin, duration, duration - child_time, len(self.stack)))
+
+    def hot_spots(self):
+        stats = OrderedDict()
+        for name, _, duration, self_time, depth in self.events:
+            if name not in stats:
+                stats[name] = [0, 0.0, 0.0, depth]
+            stats[name][0] += 1
+            stats[name][1] += duration
+            stats[name][2] += self_time
+        return sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+
+    def format_hot_spots(self, header=''):
+        roots = sum(duration for _, _, duration, _, depth in self.events if depth == 0)
+        message = header
+        message += '{:>6} {:<48} {:>7} {:>11} {:>10} {:>10} {:>7}\n'.format(
+            'rank', 'module', 'calls', 'total(ms)', 'mean(ms)', 'self(ms)', 'share')
+        for rank, (name, (count, total, self_time, depth)) in enumerate(self.hot_spots()):
+            message += '{:>6d} {:<48} {:>7d} {:>11.2f} {:>10.3f} {:>10.2f} {:>6.1f}%\n'.format(
+                rank + 1, name, count, total * 1000, total * 1000 / count, self_time * 1000,
+                100.0 * total / max(roots, 1e-12))
+        return message
+
+    # chrome://tracing / Perfetto "complete" events, one row per nesting depth
+    def save_chrome_trace(self, path):
+        trace = []
+        for name, start, duration, _, depth in self.events:
+            trace.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X',
+                          'ts': start * 1e6, 'dur': duration * 1e6,
+                          'pid': 0, 'tid': depth})
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, trace_file)
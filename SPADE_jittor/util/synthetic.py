@@ -0,0 +1,78 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import jittor as jt
+
+
+# Helpers for the command line tools that build the networks from options
+# and feed them random inputs shaped like a batch of the real dataset.
+
+# (height, width) of the training crops, see __crop in data/base_dataset.py
+def input_size(opt):
+    return int(round(opt.crop_size / opt.aspect_ratio)), opt.crop_size
+
+
+# random label map in the format returned by the dataset
+def synthetic_label(opt, batch_size):
+    h, w = input_size(opt)
+    nc = opt.label_nc + 1 if opt.contain_dontcare_label else opt.label_nc
+    return jt.randint(0, nc, (batch_size, 1, h, w)).float32()
+
+
+# one-hot semantics as produced by Pix2PixModel.preprocess_input
+def synthetic_semantics(opt, batch_size):
+    label_map = synthetic_label(opt, batch_size)
+    bs, _, h, w = label_map.shape
+    nc = opt.label_nc + 1 if opt.contain_dontcare_label else opt.label_nc
+    semantics = jt.zeros((bs, nc, h, w)).scatter_(1, label_map, jt.array(1.0))
+    if not opt.no_instance:
+        semantics = jt.contrib.concat((semantics, jt.zeros((bs, 1, h, w))), dim=1)
+    return semantics
+
+
+# One representative epoch for every progressive growing level: the first
+# epoch of each level (no alpha blending) and finally the full resolution.
+# Returns a list of (name, epoch).
+def pg_level_epochs(opt):
+    if not opt.isTrain or opt.pg_strategy == 0 or opt.pg_niter <= 0 or opt.num_D <= 1:
+        return [('full', 0)]
+    period = opt.pg_niter // (opt.num_D - 1)
+    levels = [('pg%d' % level, level * period) for level in range(opt.num_D - 1)]
+    levels.append(('full', opt.pg_niter))
+    return levels
+
+
+# a batch in the format of Pix2pixDataset.__getitem__ after collation
+def synthetic_batch(opt, batch_size):
+    h, w = input_size(opt)
+    return {'label': synthetic_label(opt, batch_size),
+            'instance': jt.zeros((batch_size, 1, h, w)) if not opt.no_instance else 0,
+            'image': jt.rand((batch_size, 3, h, w)) * 2 - 1,
+            'path': ['synthetic_%d.png' % i for i in range(batch_size)]}
+
+
+# Every epoch in [first_epoch, last_epoch] that builds a different graph:
+# per progressive growing level the first epoch without alpha blending and
+# the first one with it, then the full resolution. Kernels are compiled per
+# graph and shape, so a step at each of them compiles all kernels of a run.
+# Returns a list of (name, epoch).
+def pg_graph_epochs(opt, first_epoch, last_epoch):
+    if opt.pg_strategy == 0 or opt.pg_niter <= 0 or opt.num_D <= 1:
+        return [('full', last_epoch)]
+    period = opt.pg_niter // (opt.num_D - 1)
+    # (name, first epoch, last epoch) of every graph, alpha > 0 once the
+    # epoch is past the middle of its level
+    ranges = []
+    for level in range(opt.num_D - 1):
+        start = level * period
+        ranges.append(('pg%d' % level, start, start + period // 2))
+        ranges.append(('pg%d_blend' % level, start + period // 2 + 1, start + period - 1))
+    ranges.append(('full', opt.pg_niter, max(opt.pg_niter, last_epoch)))
+    epochs = []
+    for name, start, end in ranges:
+        epoch = max(start, first_epoch)
+        if epoch <= min(end, last_epoch):
+            epochs.append((name, epoch))
+    return epochs
@@ -0,0 +1,172 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import os
+import json
+import pickle
+import struct
+import argparse
+import numpy as np
+
+
+# Flat checkpoint format (.tensors) that can be memory-mapped:
+#   8 bytes   magic
+#   8 bytes   length of the header, little endian
+#   header    JSON: {"tensors": {name: {"dtype", "shape", "offset", "nbytes"}},
+#                    "metadata": {...}}
+#   data      raw little endian arrays, every one aligned to ALIGNMENT bytes,
+#             offsets are relative to the start of the data section
+# dtypes are numpy type codes (f4, f2, i8, ...) plus 'bf16' for bfloat16,
+# stored as the upper half of float32 and expanded to float32 when read.
+# Opening a file only parses the header; an array is read from disk when it
+# is accessed, so loading a network touches every byte once and never builds
+# python objects for the weights as unpickling does.
+MAGIC = b'SPDTNS01'
+ALIGNMENT = 64
+EXTENSION = '.tensors'
+
+
+def _aligned(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# float32 -> bfloat16 bits (uint16), rounded to nearest even
+def to_bfloat16(array):
+    bits = np.asarray(array, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    bits = bits + 0x7FFF + ((bits >> 16) & 1)
+    return (bits >> 16).astype(np.uint16)
+
+
+def from_bfloat16(bits):
+    return (np.asarray(bits, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+
+
+# |tensors|: dict of name -> numpy array. |bfloat16|: names whose arrays are
+# bfloat16 bits from to_bfloat16. Written to a temporary file first and
+# renamed, readers never see a partial file.
+def write_tensor_file(path, tensors, metadata=None, bfloat16=()):
+    entries = {}
+    offset = 0
+    arrays = []
+    for name, array in tensors.items():
+        array = np.asarray(array, order='C')
+        if array.dtype.byteorder == '>':
+            array = array.astype(array.dtype.newbyteorder('<'))
+        dtype = 'bf16' if name in bfloat16 else array.dtype.str.lstrip('<|=')
+        entries[name] = {'dtype': dtype, 'shape': list(array.shape),
+                         'offset': offset, 'nbytes': array.nbytes}
+        arrays.append((offset, array))
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'tensors': entries, 'metadata': metadata or {}}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    header += b' ' * (data_start - len(MAGIC) - 8 - len(header))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for array_offset, array in arrays:
+            f.seek(data_start + array_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# same interface as util.checkpoint_writer.write_atomic
+def write_tensor_files(paths, tensors, metadata=None):
+    for path in paths:
+        write_tensor_file(path, tensors, metadata)
+
+
+def is_tensor_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Read-only, lazily loaded view of a .tensors file. Behaves like a dict of
+# numpy arrays backed by a memory map of the file. With |cast| floating
+# point arrays are converted to that dtype when read.
+class TensorFile():
+    def __init__(self, path, cast=None):
+        self.path = path
+        self.cast = cast
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a tensor file' % path)
+            header_len, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        self.entries = header['tensors']
+        self.metadata = header['metadata']
+        self.data_start = len(MAGIC) + 8 + header_len
+        self.mmap = None
+
+    def keys(self):
+        return self.entries.keys()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def items(self):
+        for name in self.entries:
+            yield name, self[name]
+
+    def __getitem__(self, name):
+        if self.mmap is None:
+            self.mmap = np.memmap(self.path, dtype=np.uint8, mode='r')
+        entry = self.entries[name]
+        start = self.data_start + entry['offset']
+        if entry['dtype'] == 'bf16':
+            array = from_bfloat16(np.ndarray(entry['shape'], dtype='<u2', buffer=self.mmap, offset=start))
+        else:
+            array = np.ndarray(entry['shape'], dtype=np.dtype('<' + entry['dtype']),
+                               buffer=self.mmap, offset=start)
+        if self.cast is not None and np.issubdtype(array.dtype, np.floating):
+            array = array.astype(self.cast)
+        return array
+
+
+def load_pickle_weights(path):
+    with open(path, 'rb') as f:
+        weights = pickle.load(f)
+    return {k: np.asarray(v) for k, v in weights.items()}
+
+
+# a .pkl checkpoint as written by Module.save / util.save_network
+def convert_pickle(pkl_path, out_path=None):
+    if out_path is None:
+        out_path = os.path.splitext(pkl_path)[0] + EXTENSION
+    write_tensor_file(out_path, load_pickle_weights(pkl_path))
+    return out_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert .pkl checkpoints to memory-mappable .tensors files, or list one')
+    parser.add_argument('command', choices=('convert', 'info'))
+    parser.add_argument('paths', nargs='+', help='checkpoint files, or directories to convert every *_net_*.pkl in')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if args.command == 'info':
+            tensor_file = TensorFile(path)
+            print('%s: %d tensors, metadata %s' % (path, len(tensor_file), tensor_file.metadata))
+            for name, entry in tensor_file.entries.items():
+                print('  %-64s %-8s %s' % (name, entry['dtype'], tuple(entry['shape'])))
+            continue
+        if os.path.isdir(path):
+            pkl_paths = sorted(os.path.join(path, f) for f in os.listdir(path)
+                               if f.endswith('.pkl') and '_net_' in f)
+        else:
+            pkl_paths = [path]
+        for pkl_path in pkl_paths:
+            print('%s -> %s' % (pkl_path, convert_pickle(pkl_path)))
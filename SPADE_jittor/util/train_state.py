@@ -0,0 +1,123 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+
+import os
+import random
+import signal
+import pickle
+import numpy as np
+import jittor as jt
+from util.checkpoint_writer import write_atomic
+
+
+# Everything besides the network weights that --continue_train needs to
+# pick up exactly where a run stopped: optimizer moments and step counts,
+# learning rates, random number generators and the position in the epoch.
+# Saved as [epoch]_train_state.pkl next to the network checkpoints.
+
+def train_state_path(epoch, opt):
+    return os.path.join(opt.checkpoints_dir, opt.name, '%s_train_state.pkl' % epoch)
+
+
+# Optimizer.state_dict() keeps the Vars of the moments, stored as numpy.
+# The parameters and gradients are not part of the state, only their shapes
+# to check that the state belongs to the same networks.
+def optimizer_state(optimizer):
+    def to_numpy(x):
+        if isinstance(x, jt.Var):
+            return x.numpy()
+        if isinstance(x, (list, tuple)):
+            return type(x)(to_numpy(v) for v in x)
+        if isinstance(x, dict):
+            return {k: to_numpy(v) for k, v in x.items()
+                    if k not in ('params', 'grads')}
+        return x
+    state = to_numpy(optimizer.state_dict())
+    state['param_shapes'] = param_shapes(optimizer)
+    return state
+
+
+def param_shapes(optimizer):
+    return [[tuple(p.shape) for p in pg['params']] for pg in optimizer.param_groups]
+
+
+# returns False (and leaves |optimizer| untouched) if the state was saved
+# for other parameters, e.g. when a new training phase adds layers
+def load_optimizer_state(optimizer, state):
+    if state.get('param_shapes') != param_shapes(optimizer):
+        return False
+    optimizer.load_state_dict(state)
+    return True
+
+
+# Jittor does not expose the state of its generator, so it is reseeded with
+# a seed drawn here and the seed is saved; the run that keeps going and a
+# run resumed from this state then draw the same numbers.
+def rng_state():
+    seed = np.random.randint(2**31 - 1)
+    jt.set_seed(seed)
+    return {'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'jittor_seed': seed}
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    jt.set_seed(state['jittor_seed'])
+
+
+# |epoch| can be a list of names, see util.util.save_network
+def save_train_state(state, epoch, opt, writer=None):
+    epochs = epoch if isinstance(epoch, (list, tuple)) else [epoch]
+    paths = [train_state_path(ep, opt) for ep in epochs]
+    if writer is not None:
+        writer.submit(paths, state)
+    else:
+        write_atomic(paths, state)
+
+
+# Position of the shuffling of the dataloader. Jittor datasets shuffle with
+# their own generator, seeded identically in every process, so without this
+# a resumed run would repeat the permutations of the first epochs.
+def sampler_state(dataloader):
+    shuffle_rng = getattr(dataloader, '_shuffle_rng', None)
+    return None if shuffle_rng is None else shuffle_rng.bit_generator.state
+
+
+def set_sampler_state(dataloader, state):
+    if state is not None and hasattr(dataloader, '_shuffle_rng'):
+        dataloader._shuffle_rng.bit_generator.state = state
+
+
+# Makes the passes over |dataloader| start at batch |start_batch| of their
+# permutation (see BaseDataset._get_index_list), 0 for whole passes. The
+# loader workers are forked with the length of the index list, they are
+# restarted for the new length.
+def set_start_batch(dataloader, start_batch):
+    if start_batch != dataloader.start_batch:
+        dataloader.reset()
+        dataloader.start_batch = start_batch
+
+
+def load_train_state(epoch, opt):
+    path = train_state_path(epoch, opt)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+# Turns SIGTERM (preemption, job time limit) into a flag the training loop
+# checks after every iteration, so that it can save a checkpoint with the
+# full training state and exit at a consistent point.
+class TerminationHandler():
+    def __init__(self):
+        self.requested = False
+        signal.signal(signal.SIGTERM, self.handle)
+
+    def handle(self, signum, frame):
+        print('received SIGTERM, saving a checkpoint after this iteration')
+        self.requested = True
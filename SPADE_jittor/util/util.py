@@ -17,6 +17,8 @@ import util.coco
 import random
 import glob
 import cv2
+from util.checkpoint_writer import snapshot_network, write_atomic
+from util.tensor_file import TensorFile, write_tensor_files, EXTENSION as TENSOR_EXTENSION
 def DiffAugment(real_img, fake_img, label, policy=''):
     if policy:
         for p in policy.split(','):
@@ -295,16 +297,66 @@ def find_class_in_module(target_cls_name, module):
     return cls
 
 
-def save_network(net, label, epoch, opt):
-    save_filename = '%s_net_%s.pkl' % (epoch, label)
-    save_path = os.path.join(opt.checkpoints_dir, opt.name, save_filename)
-    net.save(save_path)
+def network_path(label, epoch, opt, extension='.pkl'):
+    save_filename = '%s_net_%s%s' % (epoch, label, extension)
+    return os.path.join(opt.checkpoints_dir, opt.name, save_filename)
+
+# The saved file of a network, or None. When both a .tensors and a .pkl file
+# exist (e.g. after switching --ckpt_format) the newer one wins.
+def find_network(label, epoch, opt):
+    paths = [path for path in (network_path(label, epoch, opt, TENSOR_EXTENSION), network_path(label, epoch, opt))
+             if os.path.exists(path)]
+    if len(paths) == 0:
+        return None
+    if len(paths) > 1:
+        paths.sort(key=os.path.getmtime, reverse=True)
+        print('both %s and %s exist, loading the newer %s' % (paths[0], paths[1], paths[0]))
+    return paths[0]
+
+def network_exists(label, epoch, opt):
+    return find_network(label, epoch, opt) is not None
+
+def remove_network(label, epoch, opt):
+    for path in (network_path(label, epoch, opt, TENSOR_EXTENSION), network_path(label, epoch, opt)):
+        if os.path.exists(path):
+            os.remove(path)
+
+# |net| is a network or a dict of numpy weights in the same layout.
+# |epoch| can be a list of names (e.g. ['latest', 20]) sharing one copy of
+# the weights. With |writer| (util.checkpoint_writer.AsyncCheckpointWriter)
+# the files are written in the background.
+# --ckpt_format=tensors writes memory-mappable files, see util/tensor_file.py
+def save_network(net, label, epoch, opt, writer=None):
+    epochs = epoch if isinstance(epoch, (list, tuple)) else [epoch]
+    if opt.ckpt_format == 'tensors':
+        save_paths = [network_path(label, ep, opt, TENSOR_EXTENSION) for ep in epochs]
+        write = write_tensor_files
+    else:
+        save_paths = [network_path(label, ep, opt) for ep in epochs]
+        write = write_atomic
+    weights = net if isinstance(net, dict) else snapshot_network(net)
+    if writer is not None:
+        writer.submit(save_paths, weights, write)
+    else:
+        write(save_paths, weights)
 
+# Loads the file picked by find_network. Parameters of a .tensors file are
+# read lazily from a memory map. Half precision exports (util/export_ckpt.py)
+# are expanded to float32 unless --USE_AMP runs the network in float16 anyway.
 def load_network(net, label, epoch, opt):
-    save_filename = '%s_net_%s.pkl' % (epoch, label)
-    save_dir = os.path.join(opt.checkpoints_dir, opt.name)
-    save_path = os.path.join(save_dir, save_filename)
-    net.load(save_path)
+    load_path = find_network(label, epoch, opt)
+    if load_path is None:
+        raise FileNotFoundError(network_path(label, epoch, opt))
+    if load_path.endswith(TENSOR_EXTENSION):
+        weights = TensorFile(load_path)
+        if 'export_dtype' in weights.metadata:
+            print('loading %s (%s inference export)' % (load_path, weights.metadata['export_dtype']))
+            weights.cast = np.float16 if opt.USE_AMP else np.float32
+    else:
+        weights = jt.load(load_path)
+    if hasattr(net, 'upgrade_state_dict'):
+        weights = net.upgrade_state_dict(weights)
+    net.load_parameters(weights)
     return net
 
 
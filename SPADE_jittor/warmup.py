@@ -0,0 +1,59 @@
+"""
+Copyright (C) 2019 NVIDIA Corporation.  All rights reserved.
+Licensed under the CC BY-NC-SA 4.0 license (https://creativecommons.org/licenses/by-nc-sa/4.0/legalcode).
+"""
+import time
+import jittor as jt
+from options.warmup_options import WarmupOptions
+from trainers.pix2pix_trainer import Pix2PixTrainer
+from util.batch_probe import run_train_steps, run_inference_steps, release_memory
+from util.synthetic import pg_graph_epochs
+jt.flags.use_cuda = 1
+
+# Compiles the kernels of a training run before it starts. Jittor compiles
+# a kernel the first time it meets a graph with new shapes: at every
+# progressive growing level, when the alpha blending starts, for the
+# discriminator scales in use and for the test batch. Takes the same flags
+# as train_phase.py and runs a few synthetic steps at each of these points,
+# the compiled kernels stay in the jittor cache for the real run, e.g.
+#   python warmup.py --batchSize=10 --niter=180 --pg_niter=180 --pg_strategy=1 --num_D=4
+# The weights do not change the kernels, --continue_train only selects the
+# epochs; nothing is loaded from or saved to the checkpoint directory.
+
+opt = WarmupOptions().parse()
+if opt.USE_AMP:
+    jt.flags.auto_mixed_precision_level = 5
+
+first_epoch = 1
+if opt.continue_train and opt.which_epoch.isdigit():
+    first_epoch = int(opt.which_epoch) + 1
+last_epoch = opt.niter + opt.niter_decay
+opt.continue_train = False
+
+trainer = Pix2PixTrainer(opt)
+model = trainer.pix2pix_model
+timings = []
+
+# in training order, the generator drops its intermediate heads once it
+# reaches the full resolution
+for name, epoch in pg_graph_epochs(opt, first_epoch, last_epoch):
+    print('compiling training at %s (epoch %d, batch %d)' % (name, epoch, opt.batchSize))
+    start = time.time()
+    run_train_steps(trainer, opt, epoch, opt.batchSize, opt.warmup_steps)
+    release_memory()
+    timings.append(('train_' + name, time.time() - start))
+
+if not opt.warmup_no_test:
+    test_batch_sizes = [int(bs) for bs in opt.warmup_test_batchSize.split(',') if len(bs) > 0] or [opt.batchSize]
+    model.eval()
+    for batch_size in test_batch_sizes:
+        print('compiling inference (batch %d)' % batch_size)
+        start = time.time()
+        run_inference_steps(model, opt, last_epoch, batch_size, 1)
+        release_memory()
+        timings.append(('test_batch%d' % batch_size, time.time() - start))
+    model.train()
+
+print('\n{:<20} {:>10}'.format('graph', 'seconds'))
+for name, seconds in timings:
+    print('{:<20} {:>10.1f}'.format(name, seconds))